@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark i test regresji parserów — offline, na zapisanych stronach z fixtures/
+
+Każdy plik z fixtures/expected.json przechodzi przez ten sam parser co w scraper.py
+(parse_otodom_page, parse_olx_offers, parse_domiporta_page, _pw_parse_page — stan strony
+__NEXT_DATA__/JSON-LD, a bez niego karty HTML) i raportuje:
+  - przepustowość: strony/s, karty/s, MB/s
+  - pamięć: szczytowa alokacja podczas parsowania (tracemalloc)
+  - dokładność: recall/precision po URL i zgodność pól (tytuł, cena, powierzchnia, miasto)
+
+    python scraper/bench.py                  # wszystkie fixtures
+    python scraper/bench.py -r 50 morizon    # wybrane, 50 powtórzeń
+    python scraper/bench.py --min-accuracy 0.95 --json bench.json
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import scraper
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+FIELDS       = ["title", "price", "area_m2", "city"]
+
+PW_BY_NAME = {p["url_key"].removesuffix("_url"): p for p in scraper.PW_PORTALS}
+
+
+def make_parser(name, location_key):
+    """Zwraca funkcję text → lista ofert, dokładnie tak jak wywołuje ją scraper."""
+    location = scraper.LOCATIONS[location_key]
+    if name == "otodom":
+        return lambda text: scraper.parse_otodom_page(text, location_key, location) or []
+    if name == "olx":
+        return lambda text: scraper.parse_olx_offers(json.loads(text).get("data", []), location_key, location)
+    if name == "domiporta":
+        return lambda text: scraper.parse_domiporta_page(text, location_key, location) or []
+    portal = PW_BY_NAME[name]
+    return lambda text: scraper._pw_parse_page(
+        text, portal["source"], location, location_key, portal["cards"], portal["domain"])["items"]
+
+
+def accuracy(items, expected):
+    got   = {item["url"]: item for item in items}
+    want  = {e["url"]: e for e in expected}
+    hits  = [u for u in want if u in got]
+    field = {f: sum(got[u][f] == want[u][f] for u in hits) / len(hits) if hits else 0.0 for f in FIELDS}
+    return {
+        "recall":    len(hits) / len(want) if want else 1.0,
+        "precision": len(hits) / len(got) if got else (1.0 if not want else 0.0),
+        "fields":    field,
+        "score":     (len(hits) / len(want) if want else 1.0) * (sum(field.values()) / len(FIELDS) if hits else 0.0),
+    }
+
+
+def bench_one(name, spec, repeats):
+    text   = (FIXTURES_DIR / name).read_text(encoding="utf-8")
+    parse  = make_parser(spec["parser"], spec["location"])
+    items  = parse(text)
+
+    tracemalloc.start()
+    parse(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        parse(text)
+    elapsed = time.perf_counter() - t0
+
+    size = len(text.encode("utf-8"))
+    return {
+        "fixture":   name,
+        "parser":    spec["parser"],
+        "bytes":     size,
+        "items":     len(items),
+        "ms_page":   elapsed / repeats * 1000,
+        "pages_s":   repeats / elapsed,
+        "cards_s":   len(items) * repeats / elapsed,
+        "mb_s":      size * repeats / elapsed / 1e6,
+        "peak_kb":   peak / 1024,
+        **accuracy(items, spec["expected"]),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark parserów na zapisanych stronach")
+    ap.add_argument("only", nargs="*", help="fragmenty nazw fixtures do uruchomienia")
+    ap.add_argument("-r", "--repeats", type=int, default=20)
+    ap.add_argument("--json", type=Path, help="zapisz wyniki do pliku JSON")
+    ap.add_argument("--min-accuracy", type=float, default=0.0,
+                    help="kod wyjścia 1, jeśli wynik (recall × zgodność pól) spadnie poniżej progu")
+    args = ap.parse_args()
+
+    logging.getLogger(scraper.__name__).setLevel(logging.ERROR)
+    specs = json.loads((FIXTURES_DIR / "expected.json").read_text(encoding="utf-8"))
+    names = [n for n in specs if not args.only or any(o in n for o in args.only)]
+
+    results = [bench_one(n, specs[n], args.repeats) for n in names]
+
+    print(f"{'fixture':28} {'KB':>6} {'items':>5} {'ms/str':>7} {'karty/s':>8} {'MB/s':>6} "
+          f"{'peak KB':>8} {'recall':>6} {'prec':>5} " + " ".join(f"{f[:6]:>6}" for f in FIELDS))
+    for r in results:
+        print(f"{r['fixture']:28} {r['bytes']/1024:6.0f} {r['items']:5d} {r['ms_page']:7.2f} {r['cards_s']:8.0f} "
+              f"{r['mb_s']:6.1f} {r['peak_kb']:8.0f} {r['recall']:6.2f} {r['precision']:5.2f} "
+              + " ".join(f"{r['fields'][f]:6.2f}" for f in FIELDS))
+
+    if args.json:
+        args.json.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    failed = [r["fixture"] for r in results if r["score"] < args.min_accuracy]
+    if failed:
+        print(f"\n❌ poniżej progu {args.min_accuracy}: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
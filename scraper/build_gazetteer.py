@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Buduje scraper/gazetteer.csv z wykazu miejscowości PRNG (Państwowy Rejestr Nazw Geograficznych)
+
+Wejście: zestawienie miejscowości PRNG z GUGiK zapisane jako CSV (średnik albo przecinek, UTF-8
+albo CP1250). Kolumny rozpoznawane są po nagłówkach: nazwa, rodzaj, województwo, szerokość i długość
+geograficzna (stopnie dziesiętne albo 50°02'28"), opcjonalnie dopełniacz. Plik w formacie samego
+gazetteer.csv też jest przyjmowany — wtedy tylko przeliczane są formy i flaga "common".
+
+Wyjście (kolumny gazetteer.csv):
+  - name, lat, lng, voivodeship
+  - common — 1, gdy nazwa jest też zwykłym słowem ("Łąka", "Nisko") albo powtarza się w wielu
+    miejscach; taka miejscowość sama nie wyklucza oferty (patrz is_in_location w scraper.py)
+  - forms — formy odmiany rozdzielone "|": dopełniacz z PRNG oraz dopełniacz i miejscownik
+    z prostych reguł ("Tyczyna", "Tyczynie"); scraper dopasowuje nazwy tylko jako całe słowa
+
+    python scraper/build_gazetteer.py PRNG_miejscowosci.csv
+    python scraper/build_gazetteer.py scraper/gazetteer.csv            # tylko przelicz formy
+    python scraper/build_gazetteer.py prng.csv -v podkarpackie małopolskie śląskie
+"""
+
+import argparse
+import csv
+import io
+import re
+from itertools import product
+from pathlib import Path
+
+from scraper import GAZETTEER_PATH, fold
+
+VOIVODESHIPS = ("podkarpackie", "małopolskie")
+# Rodzaje obiektów PRNG brane do gazetteera — przysiółki i części wsi mają zbyt pospolite nazwy
+KINDS = ("miasto", "wieś")
+# Nazwa występująca co najmniej tyle razy w wybranych województwach jest niejednoznaczna
+AMBIGUOUS_COUNT = 3
+# Nazwy miejscowości, które są też zwykłymi słowami z ogłoszeń
+COMMON_WORDS = {
+    "łąka", "łąki", "krasne", "ząb", "brzegi", "nisko", "chmielnik", "markowa", "jabłonka",
+    "czarna góra", "góra", "górki", "las", "potok", "pole", "wola", "zagórze", "podgórze",
+    "zalesie", "dąbrówka", "kolonia", "granica", "stawy", "nowiny", "budy", "osiedle",
+}
+
+# Nagłówek (bez diakrytyków, małe litery) → kolumna; pierwszy pasujący wygrywa
+HEADERS = {
+    "name":        ("name", "nazwa glowna", "nazwa miejscowosci", "nazwa"),
+    "kind":        ("rodzaj obiektu", "rodzaj miejscowosci", "rodzaj"),
+    "voivodeship": ("voivodeship", "wojewodztwo"),
+    "lat":         ("lat", "szerokosc"),
+    "lng":         ("lng", "dlugosc"),
+    "genitive":    ("dopelniacz",),
+    "forms":       ("forms",),
+    "common":      ("common",),
+}
+
+# Miejscownik: końcowa spółgłoska tematu → zmiękczona (Łańcut → Łańcucie, Rabka → Rabce)
+_LOCATIVE_HARD = [
+    ("ch", "sze"), ("k", "ce"), ("g", "dze"), ("r", "rze"), ("ł", "le"), ("t", "cie"), ("d", "dzie"),
+    ("sn", "śnie"), ("zn", "źnie"), ("st", "ście"), ("n", "nie"), ("m", "mie"), ("b", "bie"),
+    ("p", "pie"), ("w", "wie"), ("s", "sie"), ("z", "zie"), ("f", "fie"),
+]
+_SOFT = ("cz", "sz", "rz", "dz", "ż", "c", "l", "j", "i", "ś", "ź", "ć", "ń")
+
+
+def _locative_hard(stem):
+    for end, repl in _LOCATIVE_HARD:
+        if stem.endswith(end):
+            return stem[: -len(end)] + repl
+    return None
+
+
+def _word_forms(w, multiword):
+    """Dopełniacz i miejscownik jednego słowa nazwy: {"gen": {...}, "loc": {...}}.
+
+    Gdy reguła jest niejednoznaczna (przymiotnik czy rzeczownik na -na), kandydatów jest kilku.
+    """
+    if "-" in w:                                          # Rabka-Zdrój → Rabki-Zdroju, Rabce-Zdroju
+        parts = [_word_forms(p, False) for p in w.split("-")]
+        return {case: {"-".join(c) for c in product(*(p[case] for p in parts))} for case in ("gen", "loc")}
+    gen, loc = set(), set()
+    if w.endswith(("ska", "cka", "dzka")):                # Tatrzańska → Tatrzańskiej
+        gen = loc = {w[:-1] + "iej"}
+    elif w.endswith("owa"):                               # Markowa, Nowa → Markowej
+        gen = loc = {w[:-1] + "ej"}
+    elif w.endswith("a"):
+        stem = w[:-1]
+        if w.endswith("na") or multiword:                 # Cisna, Dolna, Sucha — może być przymiotnikiem
+            gen, loc = {stem + "ej"}, {stem + "ej"}
+        if stem.endswith("i"):                            # Bochnia → Bochni
+            gen.add(stem)
+        elif stem.endswith(("k", "g", "l", "j")):         # Rabki, Woli
+            gen.add(stem + "i")
+        else:                                             # Boguchwały, Babicy
+            gen.add(stem + "y")
+        if stem.endswith(_SOFT):                          # Woli, Babicy — miejscownik jak dopełniacz
+            loc |= gen
+        else:
+            loc.add(_locative_hard(stem) or stem + "ie")
+    elif w.endswith(("ski", "cki", "dzki")):              # Małopolski → Małopolskiego, Małopolskim
+        gen, loc = {w + "ego"}, {w + "m"}
+    elif multiword and w.endswith("y"):                   # Nowy → Nowego, Nowym
+        gen, loc = {w[:-1] + "ego"}, {w + "m"}
+    elif w.endswith(("ice", "yce")):                      # Ropczyce → Ropczyc, Ropczycach
+        gen, loc = {w[:-1]}, {w[:-1] + "ach"}
+    elif w.endswith("owce"):                              # Kluszkowce → Kluszkowiec, Kluszkowcach
+        gen, loc = {w[:-4] + "owiec"}, {w[:-1] + "ach"}
+    elif w.endswith(("ne", "we", "łe")):                  # Zakopane → Zakopanego, Zakopanem; Dolne → Dolnych
+        gen, loc = {w[:-1] + "ego", w[:-1] + "ych"}, {w[:-1] + "em", w[:-1] + "ych"}
+    elif w.endswith("e"):                                 # Zaczernie, Jedlicze
+        gen, loc = {w[:-1] + "a"}, {w[:-1] + "u"}
+    elif w.endswith(("y", "i")):                          # Szaflary, Brzegi, Ustrzyki
+        gen, loc = {w[:-1], w[:-1] + "ów"}, {w[:-1] + "ach"}
+    elif w.endswith("o"):                                 # Lesko, Krosno, Jasło
+        stem = w[:-1]
+        gen.add(stem + "a")
+        loc.add(stem + "u" if stem.endswith(("k", "g", "ch")) else _locative_hard(stem) or stem + "u")
+    elif w.endswith("ów"):                                # Rzeszów → Rzeszowa, Rzeszowie
+        gen, loc = {w[:-2] + "owa"}, {w[:-2] + "owie"}
+    else:
+        stem = w
+        if w.endswith(("ec", "ek")) and len(w) > 4:       # Dunajec → Dunajca, Brzostek → Brzostka
+            stem = w[:-2] + w[-1]
+        m = re.search(r"ó(\w{1,2})$", stem)               # Zdrój → Zdroju
+        for s in {stem, stem[: m.start()] + "o" + m.group(1)} if m else {stem}:
+            gen |= {s + "a", s + "u"}
+            if s.endswith("ław"):                         # Jarosław → Jarosławiu
+                loc.add(s + "iu")
+            elif s.endswith(_SOFT + ("k", "g", "ch")):    # Targu, Sączu, Przemyślu
+                loc.add(s + "u")
+            else:                                         # Tyczynie, Łańcucie
+                loc.add(_locative_hard(s) or s + "u")
+    return {"gen": gen, "loc": loc}
+
+
+def inflect(name):
+    """Formy odmiany nazwy (bez mianownika), każde słowo w tym samym przypadku: "Nowym Targu".
+
+    Słowa od "nad"/"pod" w górę się nie odmieniają ("Rudniku nad Sanem"); przy nazwie z łącznikiem
+    dochodzą też formy samej pierwszej części ("Rabka", "Rabce" dla Rabki-Zdroju).
+    """
+    words = name.split()
+    cut   = next((i for i, w in enumerate(words) if w in ("nad", "pod")), len(words))
+    head, tail = words[:cut], words[cut:]
+    per_word = [_word_forms(w, len(head) > 1) for w in head]
+    forms = set()
+    for case in ("gen", "loc"):
+        forms |= {" ".join((*c, *tail)) for c in product(*(f[case] for f in per_word))}
+    if len(words) == 1 and "-" in name:
+        base = name.split("-")[0]
+        forms |= {base} | inflect(base)
+    forms.discard(name)
+    return forms
+
+
+def _coord(value):
+    """Stopnie dziesiętne ("50,0412") albo stopnie, minuty, sekundy ("50°02'28.3\"N")."""
+    nums = [float(n) for n in re.findall(r"\d+(?:\.\d+)?", value.replace(",", "."))]
+    if not nums:
+        return None
+    return round(sum(n / 60 ** i for i, n in enumerate(nums[:3])), 4)
+
+
+def _columns(fieldnames):
+    folded = {fold(h).strip(): h for h in fieldnames}
+    cols = {}
+    for key, candidates in HEADERS.items():
+        for cand in candidates:
+            hit = next((h for f, h in folded.items() if f == cand or f.startswith(cand + " ")), None)
+            if hit:
+                cols[key] = hit
+                break
+    missing = {"name", "lat", "lng", "voivodeship"} - set(cols)
+    if missing:
+        raise SystemExit(f"Brak kolumn {sorted(missing)} — nagłówki pliku: {fieldnames}")
+    return cols
+
+
+def read_places(path, voivodeships):
+    raw = path.read_bytes()
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = raw.decode("cp1250")
+    dialect = csv.Sniffer().sniff(text[:4096], delimiters=";,\t")
+    rows = csv.DictReader(io.StringIO(text), dialect=dialect)
+    cols = _columns(rows.fieldnames)
+    places = []
+    for row in rows:
+        voiv = row[cols["voivodeship"]].strip().lower()
+        kind = row[cols["kind"]].strip().lower() if "kind" in cols else KINDS[0]
+        if voiv not in voivodeships or kind not in KINDS:
+            continue
+        lat, lng = _coord(row[cols["lat"]]), _coord(row[cols["lng"]])
+        if lat is None or lng is None:
+            continue
+        extra = set()
+        if "genitive" in cols and row[cols["genitive"]].strip():
+            extra.add(row[cols["genitive"]].strip())
+        places.append({"name": row[cols["name"]].strip(), "lat": lat, "lng": lng,
+                       "voivodeship": voiv, "extra": extra})
+    return places
+
+
+def build(places):
+    counts = {}
+    for p in places:
+        counts[fold(p["name"])] = counts.get(fold(p["name"]), 0) + 1
+    rows = []
+    for p in sorted(places, key=lambda p: (p["voivodeship"], fold(p["name"]), p["lat"], p["lng"])):
+        common = p["name"].lower() in COMMON_WORDS or counts[fold(p["name"])] >= AMBIGUOUS_COUNT
+        forms  = sorted((inflect(p["name"]) | p["extra"]) - {p["name"]}, key=lambda f: (fold(f), f))
+        rows.append({"name": p["name"], "lat": f"{p['lat']:.4f}", "lng": f"{p['lng']:.4f}",
+                     "voivodeship": p["voivodeship"], "common": int(common), "forms": "|".join(forms)})
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Buduje gazetteer.csv z wykazu miejscowości PRNG")
+    ap.add_argument("sources", nargs="+", type=Path, help="CSV z PRNG (albo istniejący gazetteer.csv)")
+    ap.add_argument("-v", "--voivodeships", nargs="+", default=list(VOIVODESHIPS))
+    ap.add_argument("-o", "--output", type=Path, default=GAZETTEER_PATH)
+    args = ap.parse_args()
+
+    voivodeships = {v.lower() for v in args.voivodeships}
+    places = [p for src in args.sources for p in read_places(src, voivodeships)]
+    rows = build(places)
+    with open(args.output, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["name", "lat", "lng", "voivodeship", "common", "forms"],
+                                lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"{len(rows)} miejscowości ({sum(r['common'] for r in rows)} z nazwą pospolitą) → {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Test obciążeniowy całego scrapera — main() na lokalnych atrapach portali (mock_portals.py)
+
+Adresy portali w LOCATIONS/PORTALS są przestawiane na atrapy, stan i wyniki trafiają do katalogu
+tymczasowego (docs/ zostaje nietknięte), cache HTTP jest wyłączony — każde żądanie idzie do serwera.
+Strony szczegółów i miniatury są wyłączone: linki ofert z fixtures prowadzą do prawdziwych portali.
+
+Raport: czas całkowity, żądania/s, odpowiedzi wg statusu, szczytowa pamięć (RSS procesu
+i procesów parsujących) oraz czasy etapów z RunMetrics.
+
+    python scraper/loadtest.py --fetch requests                     # bez Chromium
+    python scraper/loadtest.py --latency 300 --throttle-rps 1 --workers 12
+    python scraper/loadtest.py --rate-max 5 --json loadtest.json
+"""
+
+import argparse
+import importlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import mock_portals
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Test obciążeniowy scrapera na atrapach portali")
+    mock_portals.add_arguments(ap)
+    ap.add_argument("-p", "--portals", nargs="+", metavar="PORTAL", help="przekazywane do scraper.py")
+    ap.add_argument("-l", "--locations", nargs="+", metavar="LOC", help="przekazywane do scraper.py")
+    ap.add_argument("--fetch", choices=["requests", "playwright"], help="przekazywane do scraper.py")
+    # Ustawienia scrapera czytane przy imporcie — przekazywane przez zmienne środowiskowe
+    ap.add_argument("--workers", type=int, help="SCRAPER_WORKERS")
+    ap.add_argument("--host-concurrency", type=int, help="SCRAPER_HOST_CONCURRENCY")
+    ap.add_argument("--parse-processes", type=int, help="SCRAPER_PARSE_PROCESSES")
+    ap.add_argument("--rate-max", type=float, help="SCRAPER_RATE_MAX (żądania/s na host)")
+    ap.add_argument("--pw-pool", type=int, help="PW_POOL_SIZE")
+    ap.add_argument("--json", type=Path, help="zapisz raport do pliku JSON")
+    args = ap.parse_args()
+
+    work = Path(tempfile.mkdtemp(prefix="dzialki-loadtest-"))
+    env  = {
+        "SCRAPER_STATE_DIR":        work / "state",
+        "SCRAPER_CACHE":            "off",
+        "SCRAPER_ENRICH":           "off",
+        "SCRAPER_THUMBS":           "off",
+        "SCRAPER_WORKERS":          args.workers,
+        "SCRAPER_HOST_CONCURRENCY": args.host_concurrency,
+        "SCRAPER_PARSE_PROCESSES":  args.parse_processes,
+        "SCRAPER_RATE_MAX":         args.rate_max,
+        "PW_POOL_SIZE":             args.pw_pool,
+    }
+    os.environ.update({k: str(v) for k, v in env.items() if v is not None})
+    random.seed(args.seed)
+    scraper = importlib.import_module("scraper")
+
+    mocks = mock_portals.MockPortals(args)
+    for source, portal in scraper.PORTALS.items():
+        if source not in mocks.servers:
+            continue
+        for loc_key, loc in scraper.LOCATIONS.items():
+            loc[portal["url_key"]] = mocks.list_url(source, loc_key,
+                                                    query=portal.get("page_param", "").startswith("&"))
+        if portal["fetch"] == "playwright":
+            portal["domain"] = mocks.base_url(source)
+    scraper.PORTALS["OLX"]["api_url"] = mocks.base_url("OLX") + "/api/v1/offers/"
+
+    argv = ["--out-dir", str(work / "docs")]
+    for flag, values in (("--portals", args.portals), ("--locations", args.locations)):
+        if values:
+            argv += [flag, *values]
+    if args.fetch:
+        argv += ["--fetch", args.fetch]
+
+    t0 = time.perf_counter()
+    try:
+        scraper.main(argv)
+    finally:
+        wall = time.perf_counter() - t0
+        mocks.close()
+
+    served   = mocks.stats()
+    requests = sum(s["requests"] for s in served.values())
+    status   = {}
+    for s in served.values():
+        for code, n in s["status"].items():
+            status[code] = status.get(code, 0) + n
+    # ru_maxrss: KB na Linuksie, bajty na macOS
+    scale  = 1 if sys.platform == "darwin" else 1024
+    report = {
+        "wall_s":        round(wall, 2),
+        "requests":      requests,
+        "requests_s":    round(requests / wall, 2) if wall else 0.0,
+        "mb_served":     round(sum(s["bytes"] for s in served.values()) / 1e6, 2),
+        "status":        status,
+        "listings":      scraper.METRICS.info.get("listings_total"),
+        "peak_rss_mb":   round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6, 1),
+        "peak_child_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 1e6, 1),
+        "stages":        {stage: round(t["seconds"], 2) for stage, t in scraper.METRICS.totals.items()},
+        "portals":       served,
+        "options":       {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+    }
+
+    print(f"\n{'czas':>10} {'żądania':>8} {'żąd./s':>7} {'MB':>6} {'oferty':>7} {'RSS MB':>7} {'dzieci MB':>9}")
+    print(f"{report['wall_s']:9.1f}s {requests:8d} {report['requests_s']:7.1f} {report['mb_served']:6.1f} "
+          f"{report['listings'] or 0:7d} {report['peak_rss_mb']:7.1f} {report['peak_child_mb']:9.1f}")
+    print("statusy: " + ", ".join(f"{code}: {n}" for code, n in sorted(status.items())))
+    for source, s in served.items():
+        print(f"  {source:22} {s['requests']:5d} żądań  " + ", ".join(f"{c}: {n}" for c, n in sorted(s["status"].items())))
+    for stage, seconds in sorted(report["stages"].items(), key=lambda x: -x[1]):
+        print(f"  ⏱ {stage}: {seconds:.1f}s")
+
+    if args.json:
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Lokalne atrapy portali — strony z fixtures/ serwowane z opóźnieniem, błędami i throttlingiem 429
+
+Każdy portal dostaje własny serwer na osobnym adresie pętli zwrotnej (127.0.0.11, .12, ...),
+więc limity per host w scraperze (HostRateLimiter, semafory, pule keep-alive) działają jak
+przy prawdziwych portalach. Kolejne strony wyników to ta sama zapisana strona z id ofert
+oznaczonymi lokalizacją i numerem strony — każda strona daje nowe oferty. Fixture każdego portalu
+pochodzi z jednej lokalizacji; dla drugiej nazwy miejscowości i regionu są w nim podmieniane
+na okoliczne miejscowości tamtej lokalizacji (relocator), żeby filtr promienia nie odrzucił wszystkiego.
+
+  - Otodom, Domiporta: HTML z fixtures, paginacja ?page= / ?PageNumber=
+  - OLX: JSON jak /api/v1/offers/ (offset, limit, links.next)
+  - portale Playwright: pusta strona, której karty wstawia skrypt po --render-ms (wymaga JS)
+
+    python scraper/mock_portals.py                                # adresy serwerów na stdout
+    python scraper/mock_portals.py --latency 200 --throttle-rps 2 --error-rate 0.05
+
+Test obciążeniowy całego scrapera na tych atrapach: scraper/loadtest.py.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+# Portal → zapisana strona, parametr numeru strony i odpowiedź "brak wyników" (koniec paginacji)
+MOCK_PORTALS = {
+    "Otodom": {
+        "fixture": "otodom_rzeszow.html", "page_param": "page",
+        "empty":   '<script id="__NEXT_DATA__" type="application/json">'
+                   '{"props": {"pageProps": {"data": {"searchAds": {"items": []}}}}}</script>',
+    },
+    "OLX": {
+        "fixture": "olx_rzeszow.json", "page_param": "offset", "api": True,
+        "empty":   '{"data": [], "links": {}}',
+    },
+    "Domiporta":            {"fixture": "domiporta_zakopane.html",    "page_param": "PageNumber"},
+    "Gratka":               {"fixture": "gratka_rzeszow.html",        "page_param": "page", "js": True},
+    "Nieruchomosci-online": {"fixture": "nieruchomosci_rzeszow.html", "page_param": "page", "js": True},
+    "Adresowo":             {"fixture": "adresowo_zakopane.html",     "page_param": "page", "js": True},
+    "Morizon":              {"fixture": "morizon_zakopane.html",      "page_param": "page", "js": True},
+}
+
+# Słowa regionu (nie miejscowości) podmieniane parami przy przenoszeniu fixture do innej lokalizacji
+REGION_WORDS = {
+    "rzeszow":  ["podkarpackie", "rzeszowski", "podkarpacie"],
+    "zakopane": ["małopolskie", "tatrzański", "podhale"],
+}
+
+EMPTY_HTML = '<!DOCTYPE html><html lang="pl"><body><main><p>Brak wyników</p></main></body></html>'
+
+JS_PAGE = """<!DOCTYPE html><html lang="pl"><head><meta charset="utf-8"><title>Działki</title></head>
+<body><main id="app">Ładowanie…</main><script>
+setTimeout(function () {{ document.getElementById("app").innerHTML = {body}; }}, {delay});
+</script></body></html>"""
+
+
+def add_arguments(ap):
+    """Opcje atrap wspólne dla mock_portals.py i loadtest.py."""
+    ap.add_argument("--latency", type=float, default=100, help="średnie opóźnienie odpowiedzi (ms)")
+    ap.add_argument("--jitter", type=float, default=50, help="rozrzut opóźnienia ± (ms)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="odsetek odpowiedzi 500")
+    ap.add_argument("--throttle-rps", type=float, default=0.0,
+                    help="powyżej tylu żądań/s na portal odpowiedź 429 z Retry-After (0 = bez limitu)")
+    ap.add_argument("--retry-after", type=int, default=1, help="wartość Retry-After przy 429 (s)")
+    ap.add_argument("--pages", type=int, default=10, help="ile stron wyników ma każdy portal × lokalizacja")
+    ap.add_argument("--render-ms", type=int, default=300, help="po ilu ms skrypt strony JS wstawia karty")
+    ap.add_argument("--seed", type=int, default=1, help="ziarno losowania błędów i opóźnień")
+
+
+def _nearby_places(scraper, location_key):
+    """Nazwy miejscowości z gazetteera w promieniu lokalizacji, od najbliższej, i ich formy (fold)."""
+    loc    = scraper.LOCATIONS[location_key]
+    radius = loc["radius_km"] + scraper.GEO_RADIUS_SLACK_KM
+    forms, dist = {}, {}
+    for form, places in scraper.GAZETTEER.forms.items():
+        for name, lat, lng, _ in places:
+            d = scraper.haversine_km(*loc["center"], lat, lng)
+            if d <= radius:
+                forms.setdefault(name, set()).add(form)
+                dist[name] = d
+    return sorted(dist, key=lambda name: (dist[name], name)), forms
+
+
+def relocator(src, dst):
+    """Funkcja przepisująca tekst fixture z okolic lokalizacji `src` na okolice `dst`.
+
+    Każda miejscowość z promienia `src` (w dowolnej formie z gazetteera, także w slugach adresów)
+    staje się miejscowością `dst` o tej samej pozycji na liście od środka; słowa regionu — parami
+    z REGION_WORDS. Wielkość liter i zapis slugów ("nowy-targ") są zachowane.
+    """
+    if src == dst:
+        return lambda text: text
+    # scraper czyta ustawienia ze zmiennych środowiskowych przy imporcie — importujemy go dopiero tu,
+    # gdy loadtest.py już je ustawił
+    import scraper
+    src_names, src_forms = _nearby_places(scraper, src)
+    dst_names, _         = _nearby_places(scraper, dst)
+    targets = {}
+    for n, name in enumerate(src_names):
+        for form in src_forms[name]:
+            targets[form] = dst_names[n % len(dst_names)]
+    for word, repl in zip(REGION_WORDS[src], REGION_WORDS[dst]):
+        targets[scraper.fold(word)] = repl
+    alternation = "|".join(re.escape(f).replace("\\ ", "[ -]") for f in sorted(targets, key=len, reverse=True))
+    pattern     = re.compile(f"(?<![a-z0-9])({alternation})(?![a-z0-9])")
+
+    def styled(raw, name):
+        if raw == scraper.fold(raw):                      # slug albo zapis bez polskich znaków
+            return scraper.fold(name).replace(" ", "-" if "-" in raw or " " not in raw else " ")
+        return name.lower() if raw.islower() else name.upper() if raw.isupper() else name
+
+    def relocate(text):
+        folded = scraper.fold(text)
+        if len(folded) != len(text):                      # fold() musi zachować pozycje znaków
+            return text
+        out, last = [], 0
+        for m in pattern.finditer(folded):
+            out += [text[last:m.start()], styled(text[m.start():m.end()], targets[m.group(1).replace("-", " ")])]
+            last = m.end()
+        return "".join(out) + text[last:]
+
+    return relocate
+
+
+class _Portal:
+    """Stan jednego portalu: szablon strony, wiadro żetonów throttlingu i liczniki odpowiedzi."""
+
+    def __init__(self, source, spec, options):
+        self.source  = source
+        self.spec    = spec
+        self.options = options
+        self.text    = (FIXTURES_DIR / spec["fixture"]).read_text(encoding="utf-8")
+        self.home    = Path(spec["fixture"]).stem.rsplit("_", 1)[1]   # lokalizacja, z której jest fixture
+        self.local   = {}   # lokalizacja → (tekst, wzorzec id ofert) po przeniesieniu fixture
+        self.lock    = threading.Lock()
+        # Wiadro mieści co najmniej jedno żądanie — inaczej przy limicie < 1/s każde dostałoby 429
+        self.burst   = max(1.0, options.throttle_rps)
+        self.tokens  = self.burst
+        self.refill  = time.monotonic()
+        self.rng     = random.Random(f"{options.seed}:{source}")
+        self.stats   = {"requests": 0, "bytes": 0, "status": {}}
+
+    def localized(self, location_key):
+        """Tekst fixture przeniesiony do lokalizacji i wzorzec ostatnich segmentów adresów ofert (po nich parser liczy id)."""
+        with self.lock:
+            if location_key not in self.local:
+                relocate = relocator(self.home, location_key)
+                expected = json.loads((FIXTURES_DIR / "expected.json").read_text(encoding="utf-8"))
+                segments = {relocate(urlsplit(e["url"]).path.rstrip("/").rsplit("/", 1)[-1])
+                            for e in expected[self.spec["fixture"]]["expected"]}
+                keys = re.compile(r"(?<![\w-])(" + "|".join(map(re.escape, segments)) + r")(?![\w])")
+                self.local[location_key] = (relocate(self.text), keys)
+            return self.local[location_key]
+
+    def throttled(self):
+        if not self.options.throttle_rps:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refill) * self.options.throttle_rps)
+            self.refill = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+    def delay(self):
+        with self.lock:
+            ms = self.options.latency + self.rng.uniform(-self.options.jitter, self.options.jitter)
+            failed = self.rng.random() < self.options.error_rate
+        return max(ms, 0) / 1000, failed
+
+    def page(self, location_key, query):
+        """Treść strony `query` dla lokalizacji: szablon z id ofert oznaczonymi lokalizacją i stroną."""
+        raw = (query.get(self.spec["page_param"]) or ["0" if self.spec.get("api") else "1"])[0]
+        page = int(raw) // 40 + 1 if self.spec.get("api") else int(raw)
+        if page > self.options.pages:
+            return self.spec.get("empty", EMPTY_HTML)
+        if self.spec.get("api"):
+            # API ma jeden adres dla wszystkich lokalizacji — rozróżnia je city_id
+            location_key = self.api_locations().get((query.get("city_id") or [""])[0], self.home)
+        text, keys = self.localized(location_key)
+        tag  = f"{location_key}{page}-"
+        text = keys.sub(lambda m: tag + m.group(1), text)
+        if self.spec.get("api"):
+            data = json.loads(text)
+            if page >= self.options.pages:
+                data["links"] = {}
+            return json.dumps(data, ensure_ascii=False)
+        if self.spec.get("js"):
+            body = re.search(r"<main>(.*)</main>", text, re.S).group(1)
+            return JS_PAGE.format(body=json.dumps(body).replace("</", "<\\/"), delay=self.options.render_ms)
+        return text
+
+    @staticmethod
+    def api_locations():
+        import scraper
+        return {str(ids["city_id"]): loc_key for loc_key, ids in scraper.OLX_API_IDS.items()}
+
+    def record(self, status, size):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"]    += size
+            self.stats["status"][status] = self.stats["status"].get(status, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, jak u prawdziwych portali
+
+    def do_GET(self):
+        portal = self.server.portal
+        wait, failed = portal.delay()
+        time.sleep(wait)
+        headers = {}
+        if portal.throttled():
+            status, body = 429, "Too Many Requests"
+            headers["Retry-After"] = str(portal.options.retry_after)
+        elif failed:
+            status, body = 500, "Internal Server Error"
+        else:
+            parts = urlsplit(self.path)
+            location_key = parts.path.strip("/").split("/")[0]
+            status, body = 200, portal.page(location_key, parse_qs(parts.query))
+
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json" if portal.spec.get("api") and status == 200
+                         else "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        portal.record(status, len(data))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockPortals:
+    """Serwery atrap wszystkich (albo wybranych) portali, każdy w swoim wątku."""
+
+    def __init__(self, options, sources=None):
+        self.servers = {}
+        for n, source in enumerate(sources or MOCK_PORTALS):
+            server = self._bind(f"127.0.0.{11 + n}")
+            server.portal = _Portal(source, MOCK_PORTALS[source], options)
+            threading.Thread(target=server.serve_forever, daemon=True, name=f"mock-{source}").start()
+            self.servers[source] = server
+
+    @staticmethod
+    def _bind(host):
+        try:
+            return ThreadingHTTPServer((host, 0), _Handler)
+        except OSError:
+            # Bez dodatkowych adresów pętli zwrotnej (np. macOS) wszystkie portale dzielą 127.0.0.1
+            return ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+
+    def base_url(self, source):
+        host, port = self.servers[source].server_address[:2]
+        return f"http://{host}:{port}"
+
+    def list_url(self, source, location_key, query=False):
+        """Adres pierwszej strony wyników; `query` — z parametrem, gdy scraper dokleja numer strony przez "&"."""
+        return f"{self.base_url(source)}/{location_key}/wyniki" + ("?typ=dzialka" if query else "")
+
+    def stats(self):
+        return {source: server.portal.stats for source, server in self.servers.items()}
+
+    def close(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Lokalne atrapy portali z opóźnieniem, błędami i 429")
+    add_arguments(ap)
+    args = ap.parse_args()
+    mocks = MockPortals(args)
+    for source in mocks.servers:
+        print(f"{source:22} {mocks.list_url(source, 'rzeszow')}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(mocks.stats(), indent=2))
+        mocks.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,21 +5,50 @@ v4 - Playwright dla portali z JS renderingiem
 
 Portale requests (szybkie):  Otodom, OLX API, Domiporta
 Portale Playwright (Chrome): Gratka, Nieruchomosci-online, Adresowo, Morizon
+
+    python scraper/scraper.py                              # wszystkie portale i lokalizacje
+    python scraper/scraper.py --fetch requests             # szybkie odświeżenie bez Chromium
+    python scraper/scraper.py -p otodom gratka -l zakopane # wybrane portale / lokalizacje
 """
 
+import io
+import os
+import csv
+import argparse
+import math
 import json
+import gzip
 import time
 import random
 import re
 import hashlib
 import logging
 import asyncio
-from datetime import datetime
+import sqlite3
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
 from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from xml.sax.saxutils import escape, quoteattr
 
 import requests
-from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow jest opcjonalny — bez niego etap miniatur jest pomijany
+    Image = ImageOps = None
+try:
+    import numpy as np
+except ImportError:  # numpy jest opcjonalny — bez niego nie powstaje stats.json
+    np = None
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 log = logging.getLogger(__name__)
@@ -32,27 +61,29 @@ HEADERS = {
     "Connection": "keep-alive",
 }
 
+# Słowa kluczowe porównywane są po złożeniu polskich znaków (fold), więc wystarczy jedna pisownia
 LOCATION_KEYWORDS = {
     "rzeszow": [
-        "rzeszów", "rzeszow", "boguchwała", "boguchwa", "głogów małopolski",
-        "tyczyn", "świlcza", "swilcza", "krasne", "lubenia", "dynów", "dynow",
-        "sokołów małopolski", "strzyżów", "strzyzow", "czudec", "nisko",
-        "leżajsk", "łańcut", "lancut", "przeworsk", "jarosław", "jaroslaw",
+        "rzeszów", "boguchwała", "boguchwa", "głogów małopolski",
+        "tyczyn", "świlcza", "krasne", "lubenia", "dynów",
+        "sokołów małopolski", "strzyżów", "czudec", "łańcut",
         "podkarpacie", "podkarpackie", "rzeszowski",
     ],
     "zakopane": [
-        "zakopane", "poronin", "biały dunajec", "bialy dunajec", "szaflary",
-        "nowy targ", "bukowina tatrzańska", "bukowina tatrzanska",
-        "białka tatrzańska", "bialka tatrzanska", "murzasichle",
-        "kościelisko", "koscielisko", "chochołów", "chocholow",
-        "czarny dunajec", "rabka", "tatry", "tatrzański", "tatrzanski",
-        "małopolskie", "malopolskie", "podhale",
+        "zakopane", "poronin", "biały dunajec", "szaflary",
+        "nowy targ", "bukowina tatrzańska",
+        "białka tatrzańska", "murzasichle",
+        "kościelisko", "chochołów",
+        "czarny dunajec", "tatry", "tatrzański",
+        "małopolskie", "podhale",
     ],
 }
 
 LOCATIONS = {
     "rzeszow": {
         "label": "Rzeszów i okolice (30 km)",
+        "center":    (50.0412, 21.9991),
+        "radius_km": 30,
         "otodom_url":        "https://www.otodom.pl/pl/wyniki/sprzedaz/dzialka/podkarpackie?distanceRadius=30&locations=%5Bcities_6-935%5D&viewType=listing",
         "olx_url":           "https://www.olx.pl/nieruchomosci/dzialki/sprzedaz/rzeszow/?search[dist]=30",
         "domiporta_url":     "https://www.domiporta.pl/dzialka/sprzedam/podkarpackie/rzeszowski",
@@ -66,6 +97,8 @@ LOCATIONS = {
     },
     "zakopane": {
         "label": "Zakopane i okolice (20 km)",
+        "center":    (49.2992, 19.9496),
+        "radius_km": 20,
         "otodom_url":        "https://www.otodom.pl/pl/wyniki/sprzedaz/dzialka/malopolskie/tatrzanski/zakopane?distanceRadius=20&viewType=listing",
         "olx_url":           "https://www.olx.pl/nieruchomosci/dzialki/sprzedaz/zakopane/?search[dist]=20",
         "domiporta_url":     "https://www.domiporta.pl/dzialka/sprzedam/malopolskie/tatrzanski",
@@ -76,26 +109,511 @@ LOCATIONS = {
     },
 }
 
+# Ile zadań (portal × lokalizacja) dla scraperów requests biegnie równolegle.
+# Grzecznościowe odstępy i tak są pilnowane per host w get() (polite_wait()).
+MAX_WORKERS = int(os.environ.get("SCRAPER_WORKERS", "6"))
+# Maks. liczba równoległych żądań do jednego hosta (i rozmiar puli keep-alive na host)
+HOST_CONCURRENCY = int(os.environ.get("SCRAPER_HOST_CONCURRENCY", "2"))
+# Ile procesów parsuje pobrane strony (BeautifulSoup poza GIL-em wątków pobierających); 1 = w wątku
+PARSE_PROCESSES = int(os.environ.get("SCRAPER_PARSE_PROCESSES", str(os.cpu_count() or 1)))
+# Ile kontekstów przeglądarki (kart) renderuje równolegle w jednym Chromium
+PW_POOL_SIZE = int(os.environ.get("PW_POOL_SIZE", "3"))
+
+# Adaptacyjne tempo per host (AIMD): +RATE_STEP żądań/s po zdrowej odpowiedzi, ×RATE_BACKOFF po 429/403/captcha
+RATE_MIN     = 0.05
+RATE_MAX     = float(os.environ.get("SCRAPER_RATE_MAX", "1.0"))
+RATE_STEP    = 0.02
+RATE_BACKOFF = 0.5
+# Ile razy get() ponawia 429/503 — każda próba przechodzi przez RATE_LIMITER (feedback + nowy slot)
+THROTTLE_RETRIES = 2
+
+# Budżet renderowania strony Playwrightem (ms), o ile portal nie ustawi własnego "render_budget_ms"
+PW_RENDER_BUDGET_MS = 15000
+
+# Stan między uruchomieniami (baza ofert itp.) — w CI przenoszony przez actions/cache
+STATE_DIR = Path(os.environ.get("SCRAPER_STATE_DIR", Path(__file__).parent / "state"))
+# Oferta niewidziana od tylu dni znika z data.json
+STALE_AFTER_DAYS = 7
+# Co ile godzin pełny przebieg — pomiędzy nimi paginacja portali z "sorted_by_date" kończy się
+# na stronie samych znanych ofert. Mniej niż doba: przy cronie co 12 h przebieg zaczyna się
+# minutami po pełnej dobie (albo przed nią — opóźnienia kolejki, czas trwania), a z progiem 24 h
+# pełny przebieg co drugi raz wypadałby dopiero po 36 h
+FULL_CRAWL_HOURS = 20
+# Przerwany przebieg (timeout, awaria) jest wznawiany, jeśli zaczął się nie dawniej niż tyle godzin temu
+RESUME_MAX_AGE_HOURS = int(os.environ.get("SCRAPER_RESUME_HOURS", "13"))
+
+# Cache odpowiedzi HTTP: "on", "off" albo "replay" (tylko z dysku, bez sieci — do strojenia parserów)
+HTTP_CACHE_MODE = os.environ.get("SCRAPER_CACHE", "on")
+# Przez tyle sekund wpis jest świeży i używany bez pytania serwera
+HTTP_CACHE_TTL = int(os.environ.get("SCRAPER_CACHE_TTL", "3600"))
+# Wpisy starsze niż tyle dni są usuwane przy starcie
+HTTP_CACHE_MAX_AGE_DAYS = 7
+# Podbij po zmianie parserów — unieważnia zapamiętane wyniki parsowania niezmienionych stron
+PARSE_CACHE_VERSION = 4
+
+# Scalanie tej samej działki z różnych portali: dopuszczalna względna różnica ceny
+# i minimalne podobieństwo tytułów (Jaccard tokenów), gdy miasto nie rozstrzyga
+DEDUP_PRICE_TOLERANCE  = 0.02
+DEDUP_TITLE_SIMILARITY = 0.5
+
+# Ile ofert najwyżej w jednym pliku-shardzie w docs/data/ (większy miesiąc dzielony jest po hashu id)
+SHARD_SIZE = 500
+
+# Miejscowości ze współrzędnymi do filtrowania po odległości od "center" lokalizacji
+GAZETTEER_PATH = Path(__file__).parent / "gazetteer.csv"
+# Zapas ponad radius_km: współrzędne miejscowości to jej środek, a zabudowa sięga dalej
+GEO_RADIUS_SLACK_KM = 3
+
+# Doczytywanie stron szczegółów (pełny opis, zdjęcia, współrzędne, parametry) dla nowych/zmienionych ofert
+ENRICH_DETAILS = os.environ.get("SCRAPER_ENRICH", "on") == "on"
+# Ile stron szczegółów najwyżej na przebieg — resztę dociągną kolejne przebiegi
+ENRICH_LIMIT = int(os.environ.get("SCRAPER_ENRICH_LIMIT", "200"))
+
+# Miniatury WebP pierwszego zdjęcia oferty w docs/thumbs (wymaga Pillow)
+THUMBS        = os.environ.get("SCRAPER_THUMBS", "on") == "on"
+THUMB_SIZE    = (360, 240)
+THUMB_QUALITY = 70
+# Ile zdjęć najwyżej pobiera jeden przebieg — resztę dociągną kolejne przebiegi
+THUMB_LIMIT   = int(os.environ.get("SCRAPER_THUMB_LIMIT", "400"))
+# Większe pliki nie są zdjęciem z listingu, tylko pomyłką — nie dekodujemy ich
+THUMB_MAX_BYTES = 15 * 1024 * 1024
+
+# Kanał zmian: ile przebiegów ze zmianami trzyma docs/changes.json (2 dziennie → ~30 dni)
+# i ile najnowszych wpisów ma docs/feed.xml (Atom)
+CHANGES_KEEP = 60
+FEED_ENTRIES = 100
+# Publiczny adres strony (GitHub Pages) — link "alternate" kanału Atom; pusty = bez linku
+SITE_URL = os.environ.get("SCRAPER_SITE_URL", "")
+
+# Statystyki rynku (stats.json): kwantyle ceny i zł/m², oferty nietypowe (IQR na log zł/m²), obniżki
+STATS_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+# Miejscowość/miesiąc z mniejszą liczbą ofert z ceną za m² nie dostaje własnych statystyk
+STATS_MIN_GROUP = 5
+# Oferta nietypowa: log(zł/m²) dalej niż OUTLIER_IQR × IQR od kwartyli swojej lokalizacji
+OUTLIER_IQR = 1.5
+# Obniżka liczona od najwyższej ceny z historii; mniejsze wahania to szum
+PRICE_DROP_MIN = 0.02
+
+# Backend BeautifulSoup — lxml (jest w requirements) jest wielokrotnie szybszy od html.parser
+HTML_PARSER = "lxml"
+
+# ─── METRICS ──────────────────────────────────────────────────────────────────
+
+class RunMetrics:
+    """Czasy etapów i liczniki przebiegu (thread-safe), zapisywane jako run_report.json w STATE_DIR.
+
+    Wartości trafiają do zagnieżdżonych zakresów, np. ("portal", "Otodom", "rzeszow") albo
+    ("host", "www.otodom.pl"); czasy etapów są dodatkowo sumowane w "totals".
+    """
+
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.started = datetime.utcnow()
+        self.scopes  = {}
+        self.totals  = {}
+        self.info    = {}
+
+    def _node(self, scope):
+        node = self.scopes
+        for part in scope:
+            node = node.setdefault(str(part), {})
+        return node
+
+    def add_time(self, stage, seconds, *scope):
+        with self.lock:
+            for node in (self._node(scope), self.totals):
+                t = node.setdefault(stage, {"seconds": 0.0, "count": 0})
+                t["seconds"] += seconds
+                t["count"]   += 1
+
+    @contextmanager
+    def timer(self, stage, *scope):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - t0, *scope)
+
+    def incr(self, name, n=1, *scope):
+        with self.lock:
+            node = self._node(scope)
+            node[name] = node.get(name, 0) + n
+
+    def http_response(self, host, status, nbytes):
+        with self.lock:
+            node = self._node(("host", host))
+            node["requests"] = node.get("requests", 0) + 1
+            node["bytes"]    = node.get("bytes", 0) + nbytes
+            hist = node.setdefault("status", {})
+            hist[str(status)] = hist.get(str(status), 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps({"scopes": self.scopes, "totals": self.totals}))
+
+    def reset(self):
+        with self.lock:
+            self.scopes, self.totals = {}, {}
+
+    def merge(self, snapshot):
+        """Dolicza metryki zebrane w innym procesie (patrz _parse_worker)."""
+        def add(dst, src):
+            for k, v in src.items():
+                if isinstance(v, dict):
+                    add(dst.setdefault(k, {}), v)
+                else:
+                    dst[k] = dst.get(k, 0) + v
+        with self.lock:
+            add(self.scopes, snapshot["scopes"])
+            add(self.totals, snapshot["totals"])
+
+    def report(self):
+        def rounded(node):
+            if isinstance(node, dict):
+                return {k: rounded(v) for k, v in node.items()}
+            return round(node, 3) if isinstance(node, float) else node
+
+        finished = datetime.utcnow()
+        with self.lock:
+            return rounded({
+                "started_at":  self.started.isoformat() + "Z",
+                "finished_at": finished.isoformat() + "Z",
+                "duration_s":  (finished - self.started).total_seconds(),
+                **self.info,
+                "totals":      self.totals,
+                **self.scopes,
+            })
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+
+METRICS = RunMetrics()
+
 # ─── HELPERS ──────────────────────────────────────────────────────────────────
 
 def uid(s):
     return hashlib.md5(s.encode()).hexdigest()[:12]
 
-def sleep(a=2.0, b=4.5):
-    time.sleep(random.uniform(a, b))
-
-def get(url, referer=None):
-    h = dict(HEADERS)
+# Strony blokady/captcha antybotów — nawet ze statusem 200 oznaczają, że jedziemy za szybko.
+# Tylko znaczniki samej strony wyzwania: skrypt /cdn-cgi/challenge-platform Cloudflare wstrzykuje
+# też do zwykłych stron z ofertami, więc jego obecność niczego nie znaczy.
+CAPTCHA_RE = re.compile(r"cf-chl-|<title>Just a moment|captcha-delivery\.com|px-captcha", re.I)
+THROTTLE_STATUSES = {403, 429, 503}
+
+class HostRateLimiter:
+    """Tempo żądań per host: rośnie addytywnie, gdy serwer odpowiada zdrowo, maleje wykładniczo, gdy dławi.
+
+    Każde żądanie rezerwuje slot hosta (odstęp 1/tempo z ±20% jitterem), więc równoległe zadania
+    dla innych portali nie czekają. Tempa przechodzą między przebiegami przez bazę (load/state).
+    """
+
+    def __init__(self):
+        self.lock      = threading.Lock()
+        self.rates     = {}
+        self.next_slot = {}
+        self.throttled = {}
+
+    def load(self, state):
+        with self.lock:
+            for host, rate in state.items():
+                self.rates[host] = min(RATE_MAX, max(RATE_MIN, float(rate)))
+
+    def state(self):
+        with self.lock:
+            return {host: round(rate, 4) for host, rate in sorted(self.rates.items())}
+
+    def reserve(self, url, a, b):
+        """Rezerwuje kolejny slot hosta i zwraca, ile sekund trzeba na niego poczekać.
+
+        Dla nieznanego hosta tempo startowe to średnia z odstępu a..b podanego przez scraper.
+        """
+        host = urlsplit(url).hostname or ""
+        with self.lock:
+            rate  = self.rates.setdefault(host, min(RATE_MAX, max(RATE_MIN, 2 / (a + b))))
+            now   = time.monotonic()
+            start = max(now, self.next_slot.get(host, 0.0))
+            self.next_slot[host] = start + random.uniform(0.8, 1.2) / rate
+        return start - now
+
+    def feedback(self, host, status, text="", retry_after=None):
+        """Odpowiedź serwera: 429/403/503 albo strona captcha zwalnia hosta, każda inna go przyspiesza."""
+        throttled = status in THROTTLE_STATUSES or bool(text and CAPTCHA_RE.search(text[:200_000]))
+        with self.lock:
+            rate = self.rates.get(host, RATE_MIN * 4)
+            if throttled:
+                self.rates[host] = max(RATE_MIN, rate * RATE_BACKOFF)
+                self.throttled[host] = self.throttled.get(host, 0) + 1
+                pause = 1 / self.rates[host]
+                if retry_after and str(retry_after).isdigit():
+                    pause = max(pause, min(int(retry_after), 120))
+                self.next_slot[host] = max(self.next_slot.get(host, 0.0), time.monotonic() + pause)
+            else:
+                self.rates[host] = min(RATE_MAX, rate + RATE_STEP)
+        if throttled:
+            log.info(f"[Tempo] {host}: {status} — zwalniam do {self.rates[host]:.2f} żądań/s")
+            METRICS.incr("throttled", 1, "host", host)
+        return throttled
+
+RATE_LIMITER = HostRateLimiter()
+
+def polite_wait(url, a=2.0, b=4.5):
+    """Czeka na swoją kolej do hosta wg RATE_LIMITER; a..b s to odstęp startowy dla nowego hosta."""
+    wait = RATE_LIMITER.reserve(url, a, b)
+    if wait > 0:
+        METRICS.add_time("politeness_wait", wait, "host", urlsplit(url).hostname or "")
+        time.sleep(wait)
+
+async def apolite_wait(url, a=2.0, b=4.5):
+    """Wersja polite_wait() dla pętli asyncio (Playwright)."""
+    wait = RATE_LIMITER.reserve(url, a, b)
+    if wait > 0:
+        METRICS.add_time("politeness_wait", wait, "host", urlsplit(url).hostname or "")
+        await asyncio.sleep(wait)
+
+# ─── HTTP CLIENT ──────────────────────────────────────────────────────────────
+
+_sessions      = {}
+_host_sems     = {}
+_sessions_lock = threading.Lock()
+
+def _session(host):
+    """Zwraca współdzieloną sesję hosta (pula keep-alive, retry) i jej semafor równoległości."""
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            # Retry z backoffem tylko na błędy połączenia i 500/502/504. 429/503 ponawia get()
+            # przez RATE_LIMITER — inaczej limiter nie widziałby dławienia i nie zwalniał hosta.
+            retry = Retry(
+                total=4, connect=3, read=2, status=3,
+                backoff_factor=1.5,
+                status_forcelist=(500, 502, 504),
+                allowed_methods=frozenset(["GET"]),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HOST_CONCURRENCY, max_retries=retry)
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host]  = session
+            _host_sems[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return session, _host_sems[host]
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _host_sems.clear()
+
+# ─── HTTP CACHE ───────────────────────────────────────────────────────────────
+
+class CachedResponse:
+    """Odpowiedź z warstwy cache — podzbiór interfejsu requests.Response używany przez scrapery."""
+
+    def __init__(self, url, status_code, text, headers=None, from_cache=False, unchanged=False):
+        self.url          = url
+        self.status_code  = status_code
+        self.text         = text
+        self.headers      = headers or {}
+        self.content_hash = hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()
+        self.from_cache   = from_cache   # treść z dysku, bez pobierania
+        self.unchanged    = unchanged    # treść identyczna jak przy poprzednim pobraniu
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache:
+    """Cache odpowiedzi na dysku kluczowany URL-em: rewalidacja ETag/Last-Modified, TTL i hash treści.
+
+    Trzyma też wyniki parsowania per hash treści, więc niezmieniona strona nie jest parsowana ponownie.
+    """
+
+    def __init__(self, root, ttl=HTTP_CACHE_TTL, max_age_days=HTTP_CACHE_MAX_AGE_DAYS):
+        self.root    = Path(root)
+        self.ttl     = ttl
+        self.max_age = max_age_days * 86400
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, kind, key):
+        h = hashlib.sha1(key.encode()).hexdigest()
+        return self.root / kind / h[:2] / f"{h}.json.gz"
+
+    def _read(self, path):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.debug(f"[Cache] uszkodzony wpis {path.name}: {e}")
+            return None
+
+    def _write(self, path, obj):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def load(self, url):
+        return self._read(self._path("http", url))
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def store(self, url, text, status_code=200, headers=None):
+        """Zapisuje odpowiedź i zwraca ją jako CachedResponse z ustawionym `unchanged`."""
+        headers = headers or {}
+        prev    = self.load(url)
+        resp    = CachedResponse(url, status_code, text, headers)
+        resp.unchanged = bool(prev) and prev.get("hash") == resp.content_hash
+        self._write(self._path("http", url), {
+            "url":           url,
+            "status":        status_code,
+            "etag":          headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "hash":          resp.content_hash,
+            "fetched_at":    time.time(),
+            "text":          text,
+        })
+        return resp
+
+    def touch(self, url, entry):
+        """Serwer potwierdził (304), że wpis jest aktualny — odnów jego wiek."""
+        entry["fetched_at"] = time.time()
+        self._write(self._path("http", url), entry)
+
+    def load_parsed(self, key):
+        return self._read(self._path("parsed", key))
+
+    def store_parsed(self, key, result):
+        self._write(self._path("parsed", key), {"result": result})
+
+    def evict(self):
+        """Usuwa wpisy starsze niż max_age (po czasie modyfikacji pliku)."""
+        cutoff  = time.time() - self.max_age
+        removed = 0
+        for path in self.root.rglob("*.gz"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            log.info(f"[Cache] usunięto {removed} przeterminowanych wpisów")
+
+
+# Ustawiany w main(); None = cache wyłączony
+HTTP_CACHE = None
+
+def _entry_response(entry, unchanged=True):
+    return CachedResponse(entry["url"], entry.get("status", 200), entry["text"],
+                          from_cache=True, unchanged=unchanged)
+
+def get(url, referer=None, accept=None, pace=(2.0, 4.5)):
+    """GET przez cache i RATE_LIMITER; `pace` — odstęp startowy (s) dla nowego hosta, jak w polite_wait().
+
+    Na swoją kolej do hosta czeka tylko żądanie, które naprawdę idzie do sieci — trafienia w cache
+    i replay wracają od razu.
+    """
+    host  = urlsplit(url).hostname or ""
+    entry = HTTP_CACHE.load(url) if HTTP_CACHE else None
+    if HTTP_CACHE_MODE == "replay":
+        if not entry:
+            log.warning(f"[Cache] replay: brak {url}")
+            return None
+        METRICS.incr("cache_hits", 1, "host", host)
+        return _entry_response(entry)
+    if entry and HTTP_CACHE.is_fresh(entry):
+        METRICS.incr("cache_hits", 1, "host", host)
+        return _entry_response(entry)
+
+    session, sem = _session(host)
+    h = {}
     if referer:
         h["Referer"] = referer
+    if accept:
+        h["Accept"] = accept
+    if entry and entry.get("etag"):
+        h["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        h["If-Modified-Since"] = entry["last_modified"]
+    for attempt in range(THROTTLE_RETRIES + 1):
+        # Po 429/503 feedback() już zwolnił host i odsunął jego slot (także o Retry-After)
+        polite_wait(url, *pace)
+        try:
+            with sem, METRICS.timer("network", "host", host):
+                r = session.get(url, headers=h, timeout=25)
+        except Exception as e:
+            METRICS.http_response(host, "error", 0)
+            log.warning(f"GET failed {url}: {e}")
+            return None
+        METRICS.http_response(host, r.status_code, len(r.content))
+        RATE_LIMITER.feedback(host, r.status_code, r.text if r.status_code == 200 else "",
+                              r.headers.get("Retry-After"))
+        if r.status_code not in (429, 503):
+            break
+
+    if r.status_code == 304 and entry:
+        HTTP_CACHE.touch(url, entry)
+        return _entry_response(entry)
     try:
-        r = requests.get(url, headers=h, timeout=25)
         r.raise_for_status()
-        return r
-    except Exception as e:
+    except requests.HTTPError as e:
         log.warning(f"GET failed {url}: {e}")
         return None
 
+    if HTTP_CACHE:
+        return HTTP_CACHE.store(url, r.text, r.status_code, r.headers)
+    return CachedResponse(url, r.status_code, r.text, r.headers)
+
+# Ustawiana w main(); None = parsowanie w wątku wywołującym
+PARSE_POOL = None
+
+def _parse_worker(parser, text, args):
+    """Proces potomny: parsuje i oddaje wynik razem z metrykami zebranymi przy parsowaniu."""
+    METRICS.reset()
+    result = parser(text, *args)
+    return result, METRICS.snapshot()
+
+def run_parser(parser, text, *args):
+    """parser(text, *args) w puli procesów PARSE_POOL — wątek pobierający tylko czeka, nie trzyma GIL-a."""
+    global PARSE_POOL
+    if PARSE_POOL is not None:
+        try:
+            result, snapshot = PARSE_POOL.submit(_parse_worker, parser, text, args).result()
+            METRICS.merge(snapshot)
+            return result
+        except BrokenProcessPool as e:
+            log.warning(f"[Parse] pula procesów padła ({e}), parsuję w wątkach")
+            PARSE_POOL = None
+    return parser(text, *args)
+
+def cached_parse(r, source, location_key, parser, *args):
+    """Wywołuje parser(r.text, *args), a dla niezmienionej strony zwraca zapamiętany wynik bez parsowania."""
+    scope = ("portal", source, location_key)
+    if HTTP_CACHE is None or HTTP_CACHE_MODE == "replay":
+        with METRICS.timer("parse", *scope):
+            return run_parser(parser, r.text, *args)
+    key = f"{PARSE_CACHE_VERSION}:{source}:{location_key}:{r.content_hash}"
+    if r.unchanged:
+        hit = HTTP_CACHE.load_parsed(key)
+        if hit is not None:
+            log.debug(f"[{source}] strona bez zmian — wynik z cache")
+            METRICS.incr("parse_cache_hits", 1, *scope)
+            return hit["result"]
+    with METRICS.timer("parse", *scope):
+        result = run_parser(parser, r.text, *args)
+    HTTP_CACHE.store_parsed(key, result)
+    return result
+
+# ─── PARSING HELPERS ──────────────────────────────────────────────────────────
+
 def parse_price(text):
     if not text:
         return None
@@ -123,12 +641,339 @@ def parse_area(text):
             pass
     return None
 
+NEXT_DATA_RE    = re.compile(r"""<script[^>]*\bid=["']?__NEXT_DATA__["']?[^>]*>(.*?)</script>""", re.S)
+_SIMPLE_SEL_RE  = re.compile(r"^([a-zA-Z][\w-]*)?((?:\.[\w-]+)*)((?:\[[^\]]+\])*)$")
+_ATTR_SEL_RE    = re.compile(r"""\[\s*([\w-]+)\s*(?:(\*?=)\s*['"]?([^'"\]]*)['"]?)?\s*\]""")
+_strainer_cache = {}
+
+def extract_next_data(html):
+    """Wycina JSON z <script id="__NEXT_DATA__"> wprost z tekstu, bez budowania DOM."""
+    m = NEXT_DATA_RE.search(html)
+    return json.loads(m.group(1)) if m else None
+
+JSON_LD_RE   = re.compile(r"""<script[^>]*type=["']application/ld\+json["'][^>]*>(.*?)</script>""", re.S | re.I)
+STATE_VAR_RE = re.compile(r"(?:window\.)?__(?:INITIAL_STATE|PRELOADED_STATE|APOLLO_STATE|NUXT|STATE)__\s*=\s*(?=[{\[])")
+_JSON_DECODER = json.JSONDecoder()
+
+def extract_state_blobs(html):
+    """Wszystkie osadzone w stronie obiekty JSON: __NEXT_DATA__, JSON-LD i window.__*_STATE__ = {...}."""
+    blobs = []
+    for m in NEXT_DATA_RE.finditer(html):
+        blobs.append(m.group(1))
+    for m in JSON_LD_RE.finditer(html):
+        blobs.append(m.group(1))
+    out = []
+    for raw in blobs:
+        try:
+            out.append(json.loads(raw))
+        except ValueError:
+            pass
+    for m in STATE_VAR_RE.finditer(html):
+        try:
+            out.append(_JSON_DECODER.raw_decode(html, m.end())[0])
+        except ValueError:
+            pass
+    return out
+
+# Nazwy pól, pod którymi portale trzymają dane oferty w JSON-ie — sprawdzane po kolei
+JSON_FIELDS = {
+    "url":    ["url", "href", "link", "canonicalUrl", "permalink", "offerUrl"],
+    "title":  ["title", "name", "headline"],
+    "price":  ["totalPrice", "price", "priceValue", "priceTotal", "offers"],
+    "area":   ["areaInSquareMeters", "plotArea", "area", "areaM2", "surface", "floorSize", "powierzchnia"],
+    "city":   ["city", "cityName", "locationLabel", "location", "address", "locality"],
+    "desc":   ["shortDescription", "description", "desc"],
+    "images": ["images", "photos", "image", "photo", "thumbnail"],
+}
+
+def _jget(d, field):
+    for key in JSON_FIELDS[field]:
+        value = d.get(key)
+        if value not in (None, "", [], {}):
+            return value
+    return None
+
+def _json_scalar(value, *keys):
+    """Z wartości typu {"value": 1200, "unit": "m2"} wyciąga pierwszy niepusty z kluczy."""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        for key in keys:
+            if value.get(key) not in (None, ""):
+                return value[key]
+        return None
+    return value
+
+def _json_text(value):
+    if isinstance(value, dict):
+        parts = [value.get(k) for k in ("addressLocality", "city", "name", "value", "district", "addressRegion")]
+        return ", ".join(str(p) for p in parts if isinstance(p, (str, int)) and p)
+    if isinstance(value, list):
+        return ", ".join(filter(None, (_json_text(v) for v in value)))
+    return str(value) if value is not None else ""
+
+def _json_images(value, limit=6):
+    images = []
+    for img in value if isinstance(value, list) else [value]:
+        src = img if isinstance(img, str) else _json_scalar(img, "large", "medium", "url", "src", "contentUrl", "small")
+        if isinstance(src, str) and src.startswith("http"):
+            images.append(src)
+    return images[:limit]
+
+def _looks_like_listing(d):
+    return isinstance(d, dict) and _jget(d, "url") is not None and _jget(d, "price") is not None
+
+def find_listing_dicts(obj, _depth=0):
+    """Przeszukuje JSON i zwraca słowniki z listy wyglądającej na listę ofert (mają URL i cenę)."""
+    found = []
+    if _depth > 12:
+        return found
+    if isinstance(obj, list):
+        entries = [e["item"] if isinstance(e, dict) and isinstance(e.get("item"), dict) else e for e in obj]
+        hits    = [e for e in entries if _looks_like_listing(e)]
+        if hits and len(hits) * 2 >= len(entries):
+            return hits
+        for e in obj:
+            found.extend(find_listing_dicts(e, _depth + 1))
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            if isinstance(value, (dict, list)):
+                found.extend(find_listing_dicts(value, _depth + 1))
+    return found
+
+def parse_json_listings(blobs, source, location, location_key, base_domain):
+    """Oferty z obiektów JSON (stan strony albo odpowiedź API) — bez zgadywania po klasach CSS."""
+    results, seen, found = [], set(), 0
+    for blob in blobs:
+        for d in find_listing_dicts(blob):
+            try:
+                link = _json_scalar(_jget(d, "url"), "href", "url") or ""
+                if isinstance(link, str) and link.startswith("/"):
+                    link = base_domain + link
+                if not isinstance(link, str) or not link.startswith("http") or link in seen:
+                    continue
+                seen.add(link)
+                found += 1
+
+                title = _json_text(_jget(d, "title")) or "Działka"
+                price = _json_scalar(_jget(d, "price"), "value", "amount", "price")
+                price = parse_price(str(int(price)) if isinstance(price, (int, float)) else price)
+                area  = _json_scalar(_jget(d, "area"), "value", "amount")
+                if isinstance(area, (int, float)):
+                    area = int(area) if 10 <= area <= 1_000_000 else None
+                else:
+                    area = parse_area(area) or parse_area(title)
+                city  = _json_text(_jget(d, "city"))
+
+                check = f"{city} {title} {link}"
+                if not is_in_location(check, location_key):
+                    continue
+                results.append(make_item(source, location, location_key, title, price, area, city,
+                                         _json_text(_jget(d, "desc")), _json_images(_jget(d, "images")), link))
+            except Exception as e:
+                log.debug(f"[{source}] JSON item: {e}")
+                METRICS.incr("parse_errors", 1, "portal", source, location_key)
+    if found:
+        METRICS.incr("cards_found", found, "portal", source, location_key)
+        METRICS.incr("cards_accepted", len(results), "portal", source, location_key)
+    return results, found
+
+def _compile_simple_selector(sel):
+    """Prosty selektor CSS (tag.klasa[attr], [attr*='x']) → predykat (nazwa, atrybuty); None gdy złożony."""
+    m = _SIMPLE_SEL_RE.match(sel.strip())
+    if not m or not any(m.groups()):
+        return None
+    tag     = m.group(1)
+    classes = [c for c in m.group(2).split(".") if c]
+    attrs   = _ATTR_SEL_RE.findall(m.group(3))
+
+    def match(name, markup_attrs):
+        if tag and name != tag:
+            return False
+        if classes:
+            have = markup_attrs.get("class") or ""
+            have = have.split() if isinstance(have, str) else have
+            if not all(c in have for c in classes):
+                return False
+        for attr, op, val in attrs:
+            value = markup_attrs.get(attr)
+            if value is None:
+                return False
+            if not isinstance(value, str):
+                value = " ".join(value)
+            if (op == "=" and value != val) or (op == "*=" and val not in value):
+                return False
+        return True
+    return match
+
+def card_strainer(selectors):
+    """SoupStrainer budujący tylko poddrzewa kart; None, gdy któregoś selektora nie da się tak zawęzić."""
+    key = tuple(selectors)
+    if key not in _strainer_cache:
+        preds = [_compile_simple_selector(sel) for sel in selectors]
+        _strainer_cache[key] = (SoupStrainer(lambda name, attrs: any(p(name, attrs) for p in preds))
+                                if all(preds) else None)
+    return _strainer_cache[key]
+
+_PL_FOLD = str.maketrans("ąćęłńóśźż", "acelnoszz")
+
+def fold(text):
+    """Małe litery bez polskich znaków diakrytycznych: "Łańcut" → "lancut"."""
+    return text.lower().translate(_PL_FOLD)
+
+class LocationMatcher:
+    """Klasyfikuje tekst względem wszystkich lokalizacji naraz jednym skompilowanym wyrażeniem.
+
+    Dopasowanie jest podciągowe (jak wcześniej `kw in text`). Wyrażenie sprawdza każdą pozycję
+    i wybiera najdłuższe słowo, a słowo dziedziczy lokalizacje wszystkich słów, które zawiera —
+    dzięki temu wynik jest taki sam, jak przy sprawdzaniu każdego słowa osobno.
+    """
+
+    def __init__(self, keywords_by_location):
+        kw_locations = {}
+        for loc_key, keywords in keywords_by_location.items():
+            for kw in keywords:
+                kw_locations.setdefault(fold(kw), set()).add(loc_key)
+        self.order     = list(keywords_by_location)
+        self.locations = {
+            kw: frozenset().union(*(locs for other, locs in kw_locations.items() if other in kw))
+            for kw in kw_locations
+        }
+        alternation  = "|".join(re.escape(kw) for kw in sorted(kw_locations, key=len, reverse=True))
+        self.pattern = re.compile(f"(?=({alternation}))")
+
+    def match_all(self, text):
+        """Zbiór kluczy lokalizacji, których słowa kluczowe występują w tekście."""
+        found = set()
+        for m in self.pattern.finditer(fold(text)):
+            found |= self.locations[m.group(1)]
+            if len(found) == len(self.order):
+                break
+        return found
+
+LOCATION_MATCHER = LocationMatcher(LOCATION_KEYWORDS)
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(h))
+
+# Nazwa tuż po skrócie ulicy/alei/osiedla to adres ("ul. Krakowska"), nie miejscowość oferty
+_STREET_PREFIX_RE = re.compile(r"(?:\b(?:ul|al|os|pl)\.|\b(?:ulica|ulicy|aleja|alei|osiedle|osiedlu))\s*$")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+class Gazetteer:
+    """Miejscowości z gazetteer.csv (patrz build_gazetteer.py): rozpoznawanie nazw w tekście i zapytania przestrzenne.
+
+    Nazwy dopasowywane są tylko jako całe słowa — w mianowniku albo w jednej z form odmiany
+    z kolumny "forms" ("w Tyczynie", "okolice Nowego Targu"). Miejscowości z "common" = 1 mają nazwę
+    będącą zwykłym słowem ("łąka") albo powtarzającą się — rozstrzygają tylko, gdy nic innego nie pasuje.
+    Punkty leżą w siatce komórek CELL° × CELL°, więc najbliższa miejscowość dla współrzędnych
+    sprawdza tylko sąsiednie komórki. Wyniki dla tekstu są memoizowane.
+    """
+
+    CELL = 0.25
+
+    def __init__(self, path):
+        self.forms     = {}   # forma (fold, słowa rozdzielone spacją) → [(nazwa, lat, lng, common)]
+        self.grid      = {}   # (i, j) → [(nazwa, lat, lng, common)]
+        self.max_words = 1
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                place = (row["name"], float(row["lat"]), float(row["lng"]), row.get("common") == "1")
+                keys  = {" ".join(_WORD_RE.findall(fold(form)))
+                         for form in [row["name"], *(row.get("forms") or "").split("|")] if form}
+                for key in keys:
+                    self.forms.setdefault(key, []).append(place)
+                    self.max_words = max(self.max_words, key.count(" ") + 1)
+                self.grid.setdefault(self._cell(place[1], place[2]), []).append(place)
+        self.find        = lru_cache(maxsize=100_000)(self._find)
+        self.distance_km = lru_cache(maxsize=100_000)(self._distance_km)
+
+    def _cell(self, lat, lng):
+        return int(lat // self.CELL), int(lng // self.CELL)
+
+    def _find(self, text):
+        """Miejscowości (krotki nazwa, lat, lng, common) wymienione w tekście; najdłuższa nazwa wygrywa."""
+        folded = fold(text)
+        words  = list(_WORD_RE.finditer(folded))
+        found  = []
+        i = 0
+        while i < len(words):
+            for n in range(min(self.max_words, len(words) - i), 0, -1):
+                key = " ".join(m.group(0) for m in words[i:i + n])
+                if key in self.forms:
+                    start = words[i].start()
+                    if not _STREET_PREFIX_RE.search(folded, max(0, start - 12), start):
+                        found.extend(self.forms[key])
+                    i += n
+                    break
+            else:
+                i += 1
+        return tuple(found)
+
+    def _distance_km(self, text, location_key):
+        """Odległość najbliższej wymienionej w tekście miejscowości od środka lokalizacji; None = nic nie rozpoznano.
+
+        Miejscowości o pospolitych nazwach liczą się tylko wtedy, gdy w tekście nie ma innych.
+        """
+        places = self.find(text)
+        places = [p for p in places if not p[3]] or places
+        if not places:
+            return None
+        lat, lng = LOCATIONS[location_key]["center"]
+        return min(haversine_km(lat, lng, p[1], p[2]) for p in places)
+
+    def nearest(self, lat, lng):
+        """Najbliższa miejscowość z gazetteera (nazwa, km) albo None, gdy nic nie ma w sąsiednich komórkach."""
+        ci, cj = self._cell(lat, lng)
+        best   = None
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                for name, plat, plng, _ in self.grid.get((ci + di, cj + dj), []):
+                    d = haversine_km(lat, lng, plat, plng)
+                    if best is None or d < best[1]:
+                        best = (name, d)
+        return best
+
+GAZETTEER = Gazetteer(GAZETTEER_PATH)
+
 def is_in_location(text, location_key):
-    t = text.lower()
-    return any(kw in t for kw in LOCATION_KEYWORDS[location_key])
+    """Czy oferta leży w promieniu lokalizacji.
+
+    O przyjęciu przesądza odległość rozpoznanej w tekście miejscowości. Słowa kluczowe (np. samo
+    "podhale") decydują tylko wtedy, gdy nie rozpoznano żadnej miejscowości o jednoznacznej nazwie —
+    pospolite nazwy ("łąka") spoza promienia nie wykluczają oferty.
+    """
+    d = GAZETTEER.distance_km(text, location_key)
+    if d is not None and d <= LOCATIONS[location_key]["radius_km"] + GEO_RADIUS_SLACK_KM:
+        return True
+    if any(not p[3] for p in GAZETTEER.find(text)):
+        return False
+    return location_key in LOCATION_MATCHER.match_all(text)
+
+def _text_distance(text, location_key):
+    d = GAZETTEER.distance_km(text, location_key) if location_key in LOCATIONS else None
+    return round(d, 1) if d is not None else None
+
+def within_radius(item):
+    """Sprawdza ofertę ze współrzędnymi (ze strony szczegółów) po prawdziwej odległości; dopisuje distance_km."""
+    if item.get("lat") is None or item.get("lng") is None:
+        return True
+    loc = LOCATIONS.get(item["location_key"])
+    if not loc:
+        return True
+    d = haversine_km(*loc["center"], item["lat"], item["lng"])
+    item["distance_km"] = round(d, 1)
+    if not item.get("city"):
+        near = GAZETTEER.nearest(item["lat"], item["lng"])
+        if near:
+            item["city"] = near[0]
+    return d <= loc["radius_km"] + GEO_RADIUS_SLACK_KM
 
 def make_item(source, location, location_key, title, price, area, city, desc, images, url):
-    return {
+    t0   = time.perf_counter()
+    item = {
         "id":             uid(url or source + title + city),
         "source":         source,
         "location_area":  location["label"],
@@ -141,29 +986,1045 @@ def make_item(source, location, location_key, title, price, area, city, desc, im
         "description":    (desc or "").strip()[:500],
         "images":         images or [],
         "url":            url or "",
+        "distance_km":    _text_distance(f"{city or ''} {title or ''}", location_key),
         "scraped_at":     datetime.utcnow().isoformat(),
     }
+    METRICS.add_time("make_item", time.perf_counter() - t0, "portal", source, location_key)
+    return item
+
+
+# ─── LISTING STORE ────────────────────────────────────────────────────────────
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    id          TEXT PRIMARY KEY,
+    first_seen  TEXT NOT NULL,
+    last_seen   TEXT NOT NULL,
+    price       INTEGER,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS listings_last_seen ON listings(last_seen);
+CREATE TABLE IF NOT EXISTS price_history (
+    id          TEXT NOT NULL,
+    seen_at     TEXT NOT NULL,
+    price       INTEGER,
+    PRIMARY KEY (id, seen_at)
+);
+CREATE TABLE IF NOT EXISTS details (
+    id          TEXT PRIMARY KEY,
+    fetched_at  TEXT NOT NULL,
+    price       INTEGER,
+    data        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS frontier (
+    run_id      TEXT NOT NULL,
+    portal      TEXT NOT NULL,
+    location    TEXT NOT NULL,
+    pages       INTEGER NOT NULL DEFAULT 0,
+    items       INTEGER NOT NULL DEFAULT 0,
+    done        INTEGER NOT NULL DEFAULT 0,
+    updated_at  TEXT NOT NULL,
+    PRIMARY KEY (run_id, portal, location)
+);
+CREATE TABLE IF NOT EXISTS thumbs (
+    image_url   TEXT PRIMARY KEY,
+    fetched_at  TEXT NOT NULL,
+    file        TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key         TEXT PRIMARY KEY,
+    value       TEXT
+);
+"""
+
+class ListingStore:
+    """Trwała baza ofert (SQLite) kluczowana id z uid(): first_seen, last_seen i historia cen."""
+
+    def __init__(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db   = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript(STORE_SCHEMA)
+        # Oferty znane sprzed bieżącego przebiegu — upsert ich nie dopisuje, żeby known_page()
+        # nie brał ofert zebranych przed chwilą (np. w innej lokalizacji) za stare
+        self.known_ids = {row[0] for row in self.db.execute("SELECT id FROM listings")}
+
+        last_full = self.get_meta("last_full_crawl")
+        self.incremental = bool(last_full) and (
+            datetime.utcnow() - datetime.fromisoformat(last_full) < timedelta(hours=FULL_CRAWL_HOURS))
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def all_known(self, items):
+        return bool(items) and all(item["id"] in self.known_ids for item in items)
+
+    def seed_from(self, data_path):
+        """Pierwsze uruchomienie: przejmij oferty z istniejącego data.json, żeby nie zgubić ich dat."""
+        if self.known_ids or not data_path.exists():
+            return
+        try:
+            with open(data_path, encoding="utf-8") as f:
+                listings = json.load(f).get("listings", [])
+        except Exception as e:
+            log.warning(f"[Store] nie można wczytać {data_path}: {e}")
+            return
+        for item in listings:
+            self.upsert([item], item.get("scraped_at") or datetime.utcnow().isoformat())
+        self.known_ids.update(item["id"] for item in listings)
+        log.info(f"[Store] zaimportowano {len(listings)} ofert z {data_path.name}")
+
+    def upsert(self, items, now):
+        """Zapisuje oferty z bieżącego przebiegu; zmiana ceny trafia do price_history."""
+        with self.lock, self.db:
+            for item in items:
+                row  = self.db.execute("SELECT price FROM listings WHERE id = ?", (item["id"],)).fetchone()
+                data = json.dumps(item, ensure_ascii=False)
+                if row is None:
+                    self.db.execute(
+                        "INSERT INTO listings (id, first_seen, last_seen, price, data) VALUES (?, ?, ?, ?, ?)",
+                        (item["id"], now, now, item["price"], data))
+                    self.db.execute("INSERT OR IGNORE INTO price_history VALUES (?, ?, ?)",
+                                    (item["id"], now, item["price"]))
+                    continue
+                self.db.execute("UPDATE listings SET last_seen = ?, data = ? WHERE id = ?",
+                                (now, data, item["id"]))
+                if item["price"] is not None and item["price"] != row[0]:
+                    self.db.execute("UPDATE listings SET price = ? WHERE id = ?", (item["price"], item["id"]))
+                    self.db.execute("INSERT OR IGNORE INTO price_history VALUES (?, ?, ?)",
+                                    (item["id"], now, item["price"]))
+
+    def details(self):
+        """Zapisane szczegóły ofert: {id: (cena przy pobraniu, dane)}."""
+        return {lid: (price, json.loads(data))
+                for lid, price, data in self.db.execute("SELECT id, price, data FROM details")}
+
+    def save_details(self, lid, price, data, now):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO details (id, fetched_at, price, data) VALUES (?, ?, ?, ?)",
+                            (lid, now, price, json.dumps(data, ensure_ascii=False)))
+
+    def thumbs(self):
+        """Pobrane zdjęcia: {adres zdjęcia: ścieżka miniatury względem docs/ albo None, gdy nieużywalne}."""
+        return dict(self.db.execute("SELECT image_url, file FROM thumbs"))
+
+    def save_thumb(self, image_url, file, now):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO thumbs (image_url, fetched_at, file) VALUES (?, ?, ?)",
+                            (image_url, now, file))
+
+    def market_history(self):
+        """Kolumny do statystyk z całej bazy (także dawno niewidziane oferty) i historia cen.
+
+        Zwraca (wiersze lokalizacja, miesiąc pierwszego wystąpienia, cena, powierzchnia;
+        wiersze id, cena — posortowane po id i dacie).
+        """
+        listings = self.db.execute(
+            "SELECT json_extract(data, '$.location_key'), substr(first_seen, 1, 7), price, "
+            "json_extract(data, '$.area_m2') FROM listings").fetchall()
+        history = self.db.execute(
+            "SELECT id, price FROM price_history WHERE price IS NOT NULL ORDER BY id, seen_at").fetchall()
+        return listings, history
+
+    def frontier(self, run_id):
+        """Postęp przebiegu: {(portal, lokalizacja): (przerobione strony, zebrane oferty, zakończone)}."""
+        return {(portal, loc): (pages, items, bool(done)) for portal, loc, pages, items, done in self.db.execute(
+            "SELECT portal, location, pages, items, done FROM frontier WHERE run_id = ?", (run_id,))}
+
+    def save_frontier(self, run_id, portal, location, pages, items, done):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO frontier VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (run_id, portal, location, pages, items, int(done), datetime.utcnow().isoformat()))
+
+    def clear_frontier(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM frontier")
+
+    def listings(self, seen_since):
+        """Oferty widziane od `seen_since`, najnowsze pierwsze, z datą pierwszego wystąpienia i historią cen.
+
+        last_seen zmienia się w każdym przebiegu, więc nie trafia do rekordów — inaczej każda
+        publikacja przepisywałaby wszystkie oferty w data.json i shardach.
+        """
+        history = {}
+        for lid, seen_at, price in self.db.execute(
+                "SELECT id, seen_at, price FROM price_history ORDER BY id, seen_at"):
+            history.setdefault(lid, []).append([seen_at, price])
+
+        out = []
+        for lid, first_seen, data in self.db.execute(
+                "SELECT id, first_seen, data FROM listings WHERE last_seen >= ? "
+                "ORDER BY first_seen DESC, id", (seen_since,)):
+            item = json.loads(data)
+            item["scraped_at"] = first_seen
+            item["first_seen"] = first_seen
+            if len(history.get(lid, [])) > 1:
+                item["price_history"] = history[lid]
+            out.append(item)
+        return out
+
+    def close(self):
+        self.db.close()
+
+
+# Ustawiany w main(); scrapery pytają go, czy strona zawiera już tylko znane oferty
+STORE = None
+
+def known_page(portal, items):
+    """True, gdy w trybie przyrostowym cała strona to oferty znane z poprzednich przebiegów.
+
+    Tylko dla portali z "sorted_by_date": przy sortowaniu po trafności czy promowaniu strona
+    znanych ofert nie znaczy, że dalej nie ma nowych.
+    """
+    return (portal.get("sorted_by_date", False) and STORE is not None and STORE.incremental
+            and STORE.all_known(items))
+
+
+# ─── CRAWL FRONTIER ───────────────────────────────────────────────────────────
+
+class CrawlFrontier:
+    """Punkt kontrolny przebiegu: ile stron każdej pary portal × lokalizacja już przerobiono.
+
+    Kursor to liczba gotowych stron — scraper wznowiony z `skip` zaczyna od następnej.
+    Bez bazy (replay) postęp trzymany jest tylko w pamięci.
+    """
+
+    def __init__(self, store, run_id):
+        self.store  = store
+        self.run_id = run_id
+        self.lock   = threading.Lock()
+        self.units  = store.frontier(run_id) if store is not None else {}
+
+    def start(self, portal, location):
+        """Liczba stron do pominięcia albo None, gdy para jest już zakończona."""
+        pages, _, done = self.units.get((portal, location), (0, 0, False))
+        return None if done else pages
+
+    def _save(self, portal, location, pages, items, done):
+        with self.lock:
+            self.units[(portal, location)] = (pages, items, done)
+        if self.store is not None:
+            self.store.save_frontier(self.run_id, portal, location, pages, items, done)
+
+    def page_done(self, portal, location, n_items):
+        pages, items, _ = self.units.get((portal, location), (0, 0, False))
+        self._save(portal, location, pages + 1, items + n_items, False)
+
+    def unit_done(self, portal, location):
+        pages, items, _ = self.units.get((portal, location), (0, 0, False))
+        self._save(portal, location, pages, items, True)
+
+    def resumed(self):
+        return sum(done for _, _, done in self.units.values()), len(self.units)
+
+
+# ─── RESULT SINK ──────────────────────────────────────────────────────────────
+
+class ResultSink:
+    """Odbiera strony ofert prosto ze scraperów: odrzuca powtórzone id, dopisuje NDJSON i zapisuje do bazy.
+
+    Wyniki nie czekają w pamięci do końca przebiegu — plik NDJSON (i baza) są punktem kontrolnym,
+    więc przerwany przebieg zostawia wszystko, co zdążył zebrać. Bezpieczny dla wielu wątków.
+    """
+
+    def __init__(self, path, store=None, now=None, resume=False):
+        self.path    = Path(path)
+        self.store   = store
+        self.now     = now or datetime.utcnow().isoformat()
+        self.lock    = threading.Lock()
+        self.seen    = set()
+        self.new_ids = set()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if resume and self.path.exists():
+            self._recover()
+        self.f = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    def _recover(self):
+        """Wznowienie: oferty z przerwanej części przebiegu zostają; urwana ostatnia linia jest odrzucana."""
+        lines = self.path.read_text(encoding="utf-8").splitlines()
+        valid = []
+        for line in lines:
+            try:
+                self.seen.add(json.loads(line)["id"])
+                valid.append(line)
+            except (ValueError, KeyError, TypeError):
+                pass
+        if len(valid) != len(lines):
+            self.path.write_text("".join(line + "\n" for line in valid), encoding="utf-8")
+
+    def add(self, items):
+        with self.lock:
+            fresh = []
+            for item in items:
+                if item["id"] not in self.seen:
+                    self.seen.add(item["id"])
+                    fresh.append(item)
+            for item in fresh:
+                self.f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            self.f.flush()
+            if self.store is not None and fresh:
+                self.new_ids.update(item["id"] for item in fresh if item["id"] not in self.store.known_ids)
+                self.store.upsert(fresh, self.now)
+        METRICS.incr("sink_items", len(fresh))
+        return len(fresh)
+
+    def __len__(self):
+        return len(self.seen)
+
+    def items(self):
+        """Czyta zebrane oferty z powrotem z NDJSON, jedną po drugiej."""
+        with self.lock:
+            self.f.flush()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def close(self):
+        self.f.close()
+
+
+# ─── DETAIL PAGES ─────────────────────────────────────────────────────────────
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+def _in_poland(lat, lng):
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    return (round(lat, 6), round(lng, 6)) if 49.0 <= lat <= 55.0 and 14.0 <= lng <= 24.5 else None
+
+def _walk_details(obj, out, _depth=0):
+    """Zbiera z JSON-a stanu strony: najdłuższy opis, współrzędne, najdłuższą listę zdjęć i parametry."""
+    if _depth > 14:
+        return
+    if isinstance(obj, list):
+        for v in obj:
+            _walk_details(v, out, _depth + 1)
+        return
+    if not isinstance(obj, dict):
+        return
+    desc = obj.get("description")
+    if isinstance(desc, str) and len(desc) > len(out.get("description", "")):
+        out["description"] = desc
+    if "coords" not in out:
+        lat = obj.get("latitude", obj.get("lat"))
+        lng = obj.get("longitude", obj.get("lng", obj.get("lon")))
+        if lat is not None and lng is not None and _in_poland(lat, lng):
+            out["coords"] = _in_poland(lat, lng)
+    for key in ("images", "photos", "image"):
+        images = _json_images(obj.get(key), 20) if obj.get(key) else []
+        if len(images) > len(out.get("images", [])):
+            out["images"] = images
+    if isinstance(obj.get("addressLocality"), str) and not out.get("city"):
+        out["city"] = obj["addressLocality"]
+    for key in ("characteristics", "parameters", "params", "attributes"):
+        value = obj.get(key)
+        if isinstance(value, list):
+            for p in value:
+                if isinstance(p, dict):
+                    label = p.get("label") or p.get("name") or p.get("key")
+                    val   = p.get("localizedValue") or p.get("value") or p.get("normalizedValue")
+                    if isinstance(label, str) and isinstance(val, (str, int, float)) and str(val).strip():
+                        out.setdefault("params", {}).setdefault(label.strip()[:40], str(val).strip()[:120])
+    for v in obj.values():
+        if isinstance(v, (dict, list)):
+            _walk_details(v, out, _depth + 1)
+
+def parse_detail_page(html, base_domain):
+    """Strona szczegółów oferty → {"description", "images", "lat", "lng", "params", "city"} (tylko znalezione pola).
+
+    Najpierw stan strony (__NEXT_DATA__, JSON-LD, window.__*_STATE__), brakujące pola z HTML/meta.
+    """
+    found = {}
+    for blob in extract_state_blobs(html):
+        _walk_details(blob, found)
+
+    soup = BeautifulSoup(html, HTML_PARSER)
+    if len(found.get("description", "")) < 80:
+        meta = soup.find("meta", attrs={"property": "og:description"}) or soup.find("meta", attrs={"name": "description"})
+        candidates = [meta.get("content", "")] if meta else []
+        candidates += [el.get_text(" ", strip=True) for el in soup.select("[class*='description'], [class*='Description']")[:10]]
+        best = max(candidates, key=len, default="")
+        if len(best) > len(found.get("description", "")):
+            found["description"] = best
+    if not found.get("images"):
+        images = [m.get("content") for m in soup.find_all("meta", attrs={"property": "og:image"})]
+        for img in soup.select("[class*='gallery'] img, [class*='Gallery'] img, [class*='photo'] img")[:30]:
+            images.append(img.get("data-src") or img.get("data-lazy") or img.get("src"))
+        found["images"] = list(dict.fromkeys(i for i in images if i and i.startswith("http")))[:20]
+    if "coords" not in found:
+        lat = soup.find("meta", attrs={"property": "place:location:latitude"})
+        lng = soup.find("meta", attrs={"property": "place:location:longitude"})
+        el  = soup.select_one("[data-lat][data-lng], [data-lat][data-lon]")
+        if lat and lng:
+            found["coords"] = _in_poland(lat.get("content"), lng.get("content"))
+        elif el:
+            found["coords"] = _in_poland(el.get("data-lat"), el.get("data-lng") or el.get("data-lon"))
+    if not found.get("params"):
+        params = {}
+        for dt in soup.find_all("dt")[:40]:
+            dd = dt.find_next_sibling("dd")
+            if dd:
+                params[dt.get_text(" ", strip=True).rstrip(":")[:40]] = dd.get_text(" ", strip=True)[:120]
+        for row in soup.select("table tr")[:40]:
+            cells = row.find_all(["th", "td"])
+            if len(cells) == 2:
+                params[cells[0].get_text(" ", strip=True).rstrip(":")[:40]] = cells[1].get_text(" ", strip=True)[:120]
+        found["params"] = {k: v for k, v in params.items() if k and v}
+
+    out = {}
+    desc = re.sub(r"\s+", " ", _TAG_RE.sub(" ", found.get("description") or "")).strip()
+    if desc:
+        out["description"] = desc[:3000]
+    images = [i if not i.startswith("/") else base_domain + i for i in found.get("images") or []]
+    if images:
+        out["images"] = images[:20]
+    if found.get("coords"):
+        out["lat"], out["lng"] = found["coords"]
+    if found.get("params"):
+        out["params"] = dict(list(found["params"].items())[:25])
+    if found.get("city"):
+        out["city"] = found["city"][:100]
+    return out
+
+def apply_details(item, details):
+    """Uzupełnia rekord danymi ze strony szczegółów — niczego nie nadpisuje uboższą wersją."""
+    if len(details.get("description", "")) > len(item.get("description") or ""):
+        item["description"] = details["description"]
+    if details.get("images"):
+        item["images"] = list(dict.fromkeys((item.get("images") or []) + details["images"]))[:12]
+    if details.get("city") and not item.get("city"):
+        item["city"] = details["city"]
+    for field in ("lat", "lng", "params"):
+        if details.get(field) is not None:
+            item[field] = details[field]
+    return item
+
+def _fetch_details(item):
+    url  = item["url"]
+    host = urlsplit(url).hostname or ""
+    r = get(url, referer=f"https://{host}/", pace=(1.5, 3.5))
+    if not r:
+        METRICS.incr("detail_errors", 1, "portal", item["source"], item["location_key"])
+        return None
+    METRICS.incr("details_fetched", 1, "portal", item["source"], item["location_key"])
+    return cached_parse(r, item["source"] + ":detail", item["location_key"],
+                        parse_detail_page, f"https://{host}")
+
+def enrich_listings(current, store, now, limit=ENRICH_LIMIT):
+    """Pobiera strony szczegółów dla nowych ofert i tych, których cena zmieniła się od ostatniego pobrania.
+
+    Zapisane szczegóły trzymane są w bazie, więc każda oferta pobierana jest raz (do zmiany ceny).
+    Równoległość per host ogranicza ta sama sesja/semafor i polite_wait co scrapery.
+    """
+    known = store.details()
+    todo, waiting = [], 0
+    for item in current:
+        if item.get("url", "").startswith("http") \
+                and (item["id"] not in known or known[item["id"]][0] != item["price"]):
+            waiting += 1
+            if len(todo) < limit:
+                todo.append(item)
+    if waiting > limit:
+        log.info(f"[Szczegóły] {waiting} do pobrania, w tym przebiegu {limit}")
+
+    saved = 0
+    with METRICS.timer("enrich"), ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="detail") as pool:
+        for item, details in zip(todo, pool.map(_fetch_details, todo)):
+            if details is not None:
+                store.save_details(item["id"], item["price"], details, now)
+                saved += 1
+    log.info(f"[Szczegóły] pobrano {saved}/{len(todo)} stron szczegółów")
+
+
+# ─── THUMBNAILS ───────────────────────────────────────────────────────────────
+
+def _download_image(url, referer):
+    """GET zdjęcia bez cache HTTP (binaria) → (status, bajty); status None = błąd sieci."""
+    host = urlsplit(url).hostname or ""
+    polite_wait(url, 0.3, 0.8)
+    session, sem = _session(host)
+    try:
+        with sem, METRICS.timer("network", "host", host):
+            r = session.get(url, headers={"Referer": referer, "Accept": "image/webp,image/*;q=0.8"}, timeout=25)
+        METRICS.http_response(host, r.status_code, len(r.content))
+        RATE_LIMITER.feedback(host, r.status_code, "", r.headers.get("Retry-After"))
+    except Exception as e:
+        METRICS.http_response(host, "error", 0)
+        log.warning(f"GET failed {url}: {e}")
+        return None, b""
+    return r.status_code, r.content
+
+def make_thumb(data, docs_dir):
+    """Zdjęcie → miniatura WebP nazwana hashem treści (to samo zdjęcie = ten sam plik). Ścieżka względem docs/."""
+    name = hashlib.sha1(data).hexdigest()[:20]
+    rel  = f"thumbs/{name[:2]}/{name}.webp"
+    path = docs_dir / rel
+    if path.exists():
+        return rel
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            # JPEG dekoduje się od razu w zmniejszonej skali — kilkukrotnie szybciej niż pełne zdjęcie
+            im.draft("RGB", (THUMB_SIZE[0] * 2, THUMB_SIZE[1] * 2))
+            thumb = ImageOps.exif_transpose(im).convert("RGB")
+        thumb.thumbnail(THUMB_SIZE, Image.LANCZOS)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{name}.{threading.get_ident()}.tmp")
+        thumb.save(tmp, "WEBP", quality=THUMB_QUALITY, method=4)
+        tmp.replace(path)
+    except Exception as e:
+        log.debug(f"[Miniatury] nie można przetworzyć zdjęcia: {e}")
+        return None
+    return rel
+
+def attach_thumbs(listings, store, docs_dir, now, limit=THUMB_LIMIT):
+    """Ustawia item["thumb"] — miniaturę pierwszego zdjęcia oferty, ścieżkę względem docs/.
+
+    Każdy adres zdjęcia pobierany jest raz (wynik w bazie). Nazwa pliku to hash treści, więc duplikat
+    z innego portalu czy zdjęcie pod nowym adresem CDN nie tworzy nowego pliku; miniatury, których
+    żadna oferta już nie używa, są usuwane z docs/thumbs.
+    """
+    for item in listings:
+        item["thumb"] = None
+    if Image is None:
+        log.info("[Miniatury] brak Pillow — pomijam")
+        return
+
+    known = store.thumbs()
+    first = {}
+    for item in listings:
+        url = (item.get("images") or [""])[0]
+        if url.startswith("http"):
+            first.setdefault(url, item)
+    todo = [url for url in first
+            if url not in known or (known[url] and not (docs_dir / known[url]).exists())]
+    if len(todo) > limit:
+        log.info(f"[Miniatury] {len(todo)} zdjęć do pobrania, w tym przebiegu {limit}")
+        todo = todo[:limit]
+
+    def fetch(url):
+        host = urlsplit(first[url]["url"]).hostname or ""
+        status, data = _download_image(url, f"https://{host}/")
+        if status is None or status in THROTTLE_STATUSES or status >= 500:
+            return None  # chwilowy problem — spróbujemy w następnym przebiegu
+        rel = make_thumb(data, docs_dir) if status == 200 and len(data) <= THUMB_MAX_BYTES else None
+        store.save_thumb(url, rel, now)
+        return rel
+
+    with METRICS.timer("thumbs"), ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="thumb") as pool:
+        made = sum(rel is not None for rel in pool.map(fetch, todo))
+    if todo:
+        log.info(f"[Miniatury] nowe: {made}/{len(todo)}")
+
+    known = store.thumbs()
+    for item in listings:
+        rel = known.get((item.get("images") or [""])[0])
+        if rel and (docs_dir / rel).exists():
+            item["thumb"] = rel
+
+    used = {item["thumb"] for item in listings if item["thumb"]}
+    for path in (docs_dir / "thumbs").glob("*/*"):
+        if path.relative_to(docs_dir).as_posix() not in used:
+            path.unlink()
+
+
+# ─── CROSS-PORTAL DEDUP ───────────────────────────────────────────────────────
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_TITLE_STOPWORDS = {
+    "dzialka", "dzialki", "dzialke", "sprzedam", "sprzedaz", "na", "do", "pod", "z", "w", "i",
+    "m2", "mkw", "ar", "ary", "budowlana", "rolna", "rekreacyjna", "inwestycyjna", "oferta",
+}
+
+def _title_tokens(item):
+    text = fold(f"{item.get('title', '')} {item.get('city', '')}")
+    return {t for t in _TOKEN_RE.findall(text) if t not in _TITLE_STOPWORDS and not t.isdigit()}
+
+def _richness(item):
+    """Ile informacji niesie rekord — najbogatszy zostaje kanonicznym w grupie duplikatów."""
+    return (bool(item.get("price")) + bool(item.get("area_m2")) + bool(item.get("city"))
+            + min(len(item.get("description") or ""), 300) / 100 + min(len(item.get("images") or []), 3))
+
+def _same_listing(a, b, tokens):
+    if a["source"] == b["source"]:
+        return False
+    pa, pb = a.get("price"), b.get("price")
+    if pa and pb:
+        if abs(pa - pb) > DEDUP_PRICE_TOLERANCE * max(pa, pb):
+            return False
+    elif pa or pb:
+        return False
+    city_a, city_b = fold(a.get("city") or ""), fold(b.get("city") or "")
+    if city_a and city_a == city_b and pa:
+        return True
+    ta, tb = tokens[id(a)], tokens[id(b)]
+    return bool(ta and tb) and len(ta & tb) / len(ta | tb) >= DEDUP_TITLE_SIMILARITY
+
+def dedup_listings(listings):
+    """Scala tę samą ofertę wystawioną na kilku portalach w jeden rekord z linkami do wszystkich źródeł.
+
+    Kandydaci są grupowani (blocking) po lokalizacji i powierzchni — albo cenie, gdy powierzchni
+    brak — więc porównujemy tylko oferty z tego samego bloku zamiast wszystkich par.
+    """
+    blocks = {}
+    for item in listings:
+        key = (item["location_key"], "a", item["area_m2"]) if item.get("area_m2") else \
+              (item["location_key"], "p", item.get("price"))
+        blocks.setdefault(key, []).append(item)
+
+    tokens   = {id(item): _title_tokens(item) for item in listings}
+    group_of = {}
+    for block in blocks.values():
+        if len(block) < 2:
+            continue
+        groups = []
+        for item in block:
+            for group in groups:
+                if all(_same_listing(item, other, tokens) for other in group):
+                    group.append(item)
+                    break
+            else:
+                groups.append([item])
+        for group in groups:
+            if len(group) > 1:
+                for item in group:
+                    group_of[id(item)] = group
+
+    merged, done = [], set()
+    for item in listings:
+        group = group_of.get(id(item))
+        if group is None:
+            merged.append(item)
+            continue
+        if id(group) in done:
+            continue
+        done.add(id(group))
+
+        canon = dict(max(group, key=_richness))
+        for other in group:
+            for field in ("city", "description"):
+                if not canon.get(field) and other.get(field):
+                    canon[field] = other[field]
+            for img in other.get("images") or []:
+                if img not in canon["images"] and len(canon["images"]) < 6:
+                    canon["images"] = canon["images"] + [img]
+            if other.get("first_seen") and other["first_seen"] < canon.get("first_seen", other["first_seen"]):
+                canon["first_seen"] = canon["scraped_at"] = other["first_seen"]
+        canon["sources"] = [{"source": o["source"], "url": o["url"], "id": o["id"]} for o in group]
+        merged.append(canon)
+    return merged
+
+
+# ─── OUTPUT ───────────────────────────────────────────────────────────────────
+
+INDEX_FIELDS = ["id", "price", "area_m2", "source", "location_key"]
+
+def _write_hashed(directory, stem, obj):
+    """Zapisuje zminifikowany JSON jako `stem.<hash>.json` i zwraca nazwę pliku.
+
+    Nazwa zależy od treści, więc przeglądarka może trzymać plik w cache bezterminowo.
+    """
+    payload = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    name    = f"{stem}.{hashlib.sha1(payload.encode()).hexdigest()[:10]}.json"
+    path    = directory / name
+    if not path.exists():
+        path.write_text(payload, encoding="utf-8")
+    return name
+
+# Z opisu indeksujemy tylko początek — pełne opisy ze stron szczegółów rozdęłyby indeks
+SEARCH_DESC_CHARS = 500
+
+def build_search_index(listings):
+    """Indeks wyszukiwania dla strony: posortowany słownik tokenów fold() z listami pozycji + gotowe kolejności.
+
+    Pozycje to numery wierszy `index.rows`; listy pozycji są kodowane różnicowo (mniejszy JSON).
+    Strona szuka po prefiksie tokenu (wyszukiwanie binarne w `tokens`) i przecina listy słów zapytania.
+    """
+    postings = {}
+    for pos, item in enumerate(listings):
+        text = fold(f"{item.get('title') or ''} {item.get('city') or ''} "
+                    f"{(item.get('description') or '')[:SEARCH_DESC_CHARS]}")
+        for token in set(_TOKEN_RE.findall(text)):
+            postings.setdefault(token, []).append(pos)
+    tokens = sorted(postings)
+
+    def deltas(positions):
+        return [b - a for a, b in zip([0] + positions, positions)]
+
+    def order(field, descending=False):
+        present = [i for i, item in enumerate(listings) if item.get(field)]
+        present.sort(key=lambda i: listings[i][field], reverse=descending)
+        return present + [i for i, item in enumerate(listings) if not item.get(field)]
+
+    return {
+        "tokens":   tokens,
+        "postings": [deltas(postings[t]) for t in tokens],
+        "orders": {
+            "newest":     order("scraped_at", descending=True),
+            "price_asc":  order("price"),
+            "price_desc": order("price", descending=True),
+            "area_asc":   order("area_m2"),
+        },
+    }
+
+def write_shards(listings, summary, data_dir, stats=None):
+    """Zapisuje docs/data/: indeks (kolumny INDEX_FIELDS), indeks wyszukiwania, statystyki rynku,
+    shardy per lokalizacja × miesiąc pierwszego pojawienia się oferty i manifest.
+
+    Klucz shardu jest stały dla oferty, więc nowe oferty trafiają do shardu bieżącego miesiąca,
+    a starsze shardy zachowują hash (i miejsce w cache przeglądarki), dopóki ich oferty się nie zmienią.
+    manifest.json jest jedynym plikiem o stałej nazwie — wskazuje aktualne pliki z hashem.
+    Pliki, do których manifest już nie prowadzi, są usuwane.
+    """
+    data_dir.mkdir(parents=True, exist_ok=True)
+    index = {
+        "fields": INDEX_FIELDS,
+        "rows":   [[item.get(f) for f in INDEX_FIELDS] for item in listings],
+    }
+    manifest = dict(summary)
+    manifest["index"]  = _write_hashed(data_dir, "index", index)
+    manifest["search"] = _write_hashed(data_dir, "search", build_search_index(listings))
+    if stats is not None:
+        manifest["stats"] = _write_hashed(data_dir, "stats", stats)
+    manifest["shards"] = []
+
+    groups = {}
+    for item in listings:
+        month = (item.get("first_seen") or item.get("scraped_at") or "")[:7] or "unknown"
+        groups.setdefault((item["location_key"], month), []).append(item)
+    for (loc_key, month), items in sorted(groups.items()):
+        items.sort(key=lambda item: item["id"])
+        # Podział na 2^k kubełków po hashu id zmienia się tylko przy przekroczeniu progu, nie z każdą ofertą
+        buckets = 1
+        while len(items) > buckets * SHARD_SIZE:
+            buckets *= 2
+        for n in range(buckets):
+            chunk = [item for item in items if int(uid(item["id"]), 16) % buckets == n]
+            if not chunk:
+                continue
+            name = f"listings-{loc_key}-{month}" + (f"-{n}" if buckets > 1 else "")
+            manifest["shards"].append({
+                "location_key": loc_key,
+                "month":        month,
+                "count":        len(chunk),
+                "file":         _write_hashed(data_dir, name, chunk),
+            })
+
+    with open(data_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+
+    referenced = {manifest["index"], manifest["search"], manifest.get("stats"), "manifest.json"} \
+        | {sh["file"] for sh in manifest["shards"]}
+    for path in data_dir.glob("*.json"):
+        if path.name not in referenced:
+            path.unlink()
+    return manifest
+
+
+# ─── CHANGE FEED ──────────────────────────────────────────────────────────────
+
+CHANGE_FIELDS = ["id", "title", "url", "price", "area_m2", "city", "location_key", "source", "thumb"]
+
+def _change_keys(item):
+    """Id wszystkich źródeł oferty — scalony rekord może między przebiegami zmienić id kanoniczne."""
+    return [s["id"] for s in item.get("sources") or []] or [item["id"]]
+
+def _brief(item):
+    return {f: item.get(f) for f in CHANGE_FIELDS}
+
+def diff_snapshots(old, new):
+    """Porównuje poprzednią i bieżącą listę ofert po kluczach źródeł: dodane, usunięte, zmiany ceny."""
+    old_by_key = {key: item for item in old for key in _change_keys(item)}
+    new_keys   = {key for item in new for key in _change_keys(item)}
+    added, changed = [], []
+    for item in new:
+        prev = next((old_by_key[k] for k in _change_keys(item) if k in old_by_key), None)
+        if prev is None:
+            added.append(_brief(item))
+        elif item.get("price") and prev.get("price") and item["price"] != prev["price"]:
+            changed.append({**_brief(item), "old_price": prev["price"]})
+    removed = [_brief(item) for item in old if not any(k in new_keys for k in _change_keys(item))]
+    return {"added": added, "removed": removed, "price_changed": changed}
+
+def _fmt_pln(price):
+    return f"{price:,}".replace(",", " ") + " zł" if price else "cena na zapytanie"
+
+def write_atom_feed(runs, path, limit=FEED_ENTRIES):
+    """docs/feed.xml: nowe oferty i zmiany cen z ostatnich przebiegów, najnowsze pierwsze."""
+    entries = []
+    for run in runs:
+        for item in run["added"]:
+            entries.append((run["at"], "added", f"Nowa: {item['title']} — {_fmt_pln(item['price'])}", item))
+        for item in run["price_changed"]:
+            entries.append((run["at"], "price", f"Zmiana ceny: {item['title']} — "
+                            f"{_fmt_pln(item['old_price'])} → {_fmt_pln(item['price'])}", item))
+    lines = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<feed xmlns="http://www.w3.org/2005/Atom">',
+        "  <title>Działki — nowe oferty i zmiany cen</title>",
+        "  <id>urn:dzialki:feed</id>",
+        f"  <updated>{runs[0]['at']}</updated>",
+    ]
+    if SITE_URL:
+        lines.append(f'  <link rel="alternate" href={quoteattr(SITE_URL)}/>')
+    for at, kind, title, item in entries[:limit]:
+        summary = ", ".join(str(v) for v in (item.get("city"), item.get("area_m2") and f"{item['area_m2']} m²",
+                                             item.get("source")) if v)
+        lines += [
+            "  <entry>",
+            f"    <title>{escape(title)}</title>",
+            f"    <id>urn:dzialki:{item['id']}:{kind}:{at}</id>",
+            f"    <updated>{at}</updated>",
+            f'    <link rel="alternate" href={quoteattr(item.get("url") or SITE_URL)}/>',
+            f"    <summary>{escape(summary)}</summary>",
+            "  </entry>",
+        ]
+    lines.append("</feed>")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+def write_changes(diff, at, docs_dir, keep=CHANGES_KEEP):
+    """Dopisuje zmiany przebiegu na początek docs/changes.json i odświeża docs/feed.xml.
+
+    Przebieg bez zmian nie rusza żadnego z plików, więc nie dokłada nic do historii gita.
+    """
+    if not any(diff.values()):
+        return False
+    path = docs_dir / "changes.json"
+    runs = []
+    if path.exists():
+        try:
+            runs = json.loads(path.read_text(encoding="utf-8")).get("runs", [])
+        except Exception as e:
+            log.warning(f"[Zmiany] nie można wczytać {path.name}: {e}")
+    runs = ([{"at": at, **diff}] + runs)[:keep]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"updated_at": at, "runs": runs}, f, ensure_ascii=False, indent=1)
+    write_atom_feed(runs, docs_dir / "feed.xml")
+    return True
+
+
+# ─── MARKET STATS ─────────────────────────────────────────────────────────────
+
+def _column(values):
+    """Lista liczb (None = brak) → tablica float z NaN w miejscu braków."""
+    return np.array([v if v else np.nan for v in values], dtype=float)
+
+def _quantiles(values):
+    q = np.quantile(values, STATS_QUANTILES)
+    return {f"p{round(x * 100)}": round(float(v)) for x, v in zip(STATS_QUANTILES, q)}
+
+def _price_drops(history):
+    """Historia cen (id, cena; po id i dacie) → {id: spadek od najwyższej ceny jako ułamek}."""
+    if not history:
+        return {}
+    ids    = np.array([lid for lid, _ in history])
+    prices = np.array([price for _, price in history], dtype=float)
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    ends   = np.r_[starts[1:], len(ids)] - 1
+    peak   = np.maximum.reduceat(prices, starts)
+    drop   = 1 - prices[ends] / peak
+    hit    = np.flatnonzero(drop >= PRICE_DROP_MIN)
+    return dict(zip(ids[starts[hit]].tolist(), drop[hit].tolist()))
+
+def market_stats(listings, history=None):
+    """Statystyki rynku dla strony; przy okazji ustawia w ofertach price_per_m2, outlier i price_drop_pct.
+
+    Obliczenia idą na kolumnach numpy (cena, powierzchnia, lokalizacja, miejscowość), więc koszt
+    rośnie liniowo z liczbą ofert. `history` to wynik ListingStore.market_history() — z niego
+    trend miesięczny i obniżki cen; bez niego (replay) tylko statystyki bieżących ofert.
+    """
+    for item in listings:
+        item["price_per_m2"] = item["outlier"] = item["price_drop_pct"] = None
+    if np is None:
+        log.info("[Statystyki] brak numpy — pomijam")
+        return None
+
+    price = _column([item.get("price") for item in listings])
+    area  = _column([item.get("area_m2") for item in listings])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ppm2 = price / area
+    valid = np.isfinite(ppm2)
+    loc   = np.array([item["location_key"] for item in listings])
+    city  = np.array([fold(item.get("city") or "").strip() for item in listings])
+    names = {}
+    for item, key in zip(listings, city):
+        names.setdefault(key, item.get("city"))
+
+    outlier = np.full(len(listings), "", dtype=object)
+    stats   = {"all": {"count": len(listings)}, "locations": {}, "cities": [], "trend": {}}
+    if np.isfinite(price).any():
+        stats["all"]["price"] = _quantiles(price[np.isfinite(price)])
+    if valid.any():
+        stats["all"]["price_per_m2"] = _quantiles(ppm2[valid])
+    for loc_key in LOCATIONS:
+        in_loc = loc == loc_key
+        has_price, has_ppm2 = in_loc & np.isfinite(price), in_loc & valid
+        entry = {"label": LOCATIONS[loc_key]["label"], "count": int(in_loc.sum()),
+                 "with_price": int(has_price.sum()), "outliers": 0, "price_drops": 0}
+        if has_price.any():
+            entry["price"] = _quantiles(price[has_price])
+        if has_ppm2.sum() >= STATS_MIN_GROUP:
+            entry["price_per_m2"] = _quantiles(ppm2[has_ppm2])
+            # Ceny działek są mocno prawoskośne — kwartyle i IQR liczone na logarytmie
+            log_ppm2 = np.log(ppm2[has_ppm2])
+            q1, q3   = np.quantile(log_ppm2, (0.25, 0.75))
+            spread   = OUTLIER_IQR * (q3 - q1)
+            rows     = np.flatnonzero(has_ppm2)
+            outlier[rows[log_ppm2 < q1 - spread]] = "low"
+            outlier[rows[log_ppm2 > q3 + spread]] = "high"
+            entry["outliers"] = int((outlier[rows] != "").sum())
+        stats["locations"][loc_key] = entry
+
+        keys, counts = np.unique(city[has_ppm2], return_counts=True)
+        for key in keys[(counts >= STATS_MIN_GROUP) & (keys != "")]:
+            in_city = has_ppm2 & (city == key)
+            stats["cities"].append({"location_key": loc_key, "city": names[key], "count": int(in_city.sum()),
+                                    "price_per_m2": _quantiles(ppm2[in_city])})
+    stats["cities"].sort(key=lambda c: (-c["count"], c["city"]))
+
+    drops = {}
+    if history is not None:
+        rows, price_rows = history
+        drops = _price_drops(price_rows)
+        h_loc   = np.array([r[0] or "" for r in rows])
+        h_month = np.array([r[1] or "" for r in rows])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            h_ppm2 = _column([r[2] for r in rows]) / _column([r[3] for r in rows])
+        h_valid = np.isfinite(h_ppm2)
+        for loc_key in LOCATIONS:
+            sel = h_valid & (h_loc == loc_key)
+            months, inverse, counts = np.unique(h_month[sel], return_inverse=True, return_counts=True)
+            values = h_ppm2[sel]
+            stats["trend"][loc_key] = [
+                [str(month), round(float(np.median(values[inverse == n]))), int(counts[n])]
+                for n, month in enumerate(months) if counts[n] >= STATS_MIN_GROUP]
+
+    for n, item in enumerate(listings):
+        if valid[n]:
+            item["price_per_m2"] = round(float(ppm2[n]))
+        item["outlier"] = outlier[n] or None
+        if item["id"] in drops:
+            item["price_drop_pct"] = round(drops[item["id"]] * 100, 1)
+            # Oferta z bazy może mieć lokalizację, której już nie ma w LOCATIONS
+            if item.get("location_key") in stats["locations"]:
+                stats["locations"][item["location_key"]]["price_drops"] += 1
+    return stats
 
 
 # ─── PLAYWRIGHT HELPER ────────────────────────────────────────────────────────
 
-def pw_get_html(page, url, wait_selector=None, wait_ms=3000):
-    """Ładuje stronę Playwrightem i zwraca HTML po wyrenderowaniu JS."""
-    try:
-        page.goto(url, wait_until="networkidle", timeout=45000)
-        if wait_selector:
-            try:
-                page.wait_for_selector(wait_selector, timeout=10000)
-            except PWTimeout:
-                page.wait_for_timeout(wait_ms)
+# Typy zasobów niepotrzebne do odczytania kart ofert
+PW_BLOCKED_TYPES = {"image", "imageset", "media", "font", "stylesheet", "texttrack", "manifest", "websocket", "eventsource"}
+# Reklamy i trackery — blokowane zawsze, niezależnie od typu zasobu
+PW_TRACKER_HOSTS = (
+    "googletagmanager.com", "google-analytics.com", "doubleclick.net", "googlesyndication.com",
+    "googleadservices.com", "adservice.google.com", "facebook.net", "facebook.com", "hotjar.com",
+    "criteo.com", "criteo.net", "adform.net", "gemius.pl", "clarity.ms", "scorecardresearch.com",
+    "adnxs.com", "rubiconproject.com", "pubmatic.com", "smartadserver.com", "taboola.com",
+    "outbrain.com", "tiktok.com", "linkedin.com", "pinterest.com", "bing.com", "yandex.ru",
+)
+# Portale (source), dla których pełne blokowanie skryptów zewnętrznych zepsuło render — tylko trackery
+_PW_RELAXED = set()
+
+def _site(host):
+    """Domena rejestrowalna w przybliżeniu: www.morizon.pl → morizon.pl, a.b.com.pl → b.com.pl."""
+    parts = host.split(".")
+    n = 3 if len(parts) > 2 and parts[-2] in ("com", "net", "org", "co", "gov") else 2
+    return ".".join(parts[-n:])
+
+def _pw_router(portal):
+    """Handler page.route: blokuje zbędne typy zasobów, trackery i skrypty spoza domeny portalu."""
+    source      = portal["source"]
+    stats_host  = urlsplit(portal["domain"]).hostname or ""
+    first_party = {_site(stats_host), *portal.get("first_party", [])}
+
+    async def handle(route):
+        req    = route.request
+        host   = urlsplit(req.url).hostname or ""
+        rtype  = req.resource_type
+        reason = None
+        if rtype in PW_BLOCKED_TYPES:
+            reason = rtype
+        elif any(host == t or host.endswith("." + t) for t in PW_TRACKER_HOSTS):
+            reason = "tracker"
+        elif rtype == "script" and _site(host) not in first_party and source not in _PW_RELAXED:
+            reason = "third_party_script"
+
+        if reason:
+            METRICS.incr(f"blocked_{reason}", 1, "host", stats_host)
+            await route.abort()
         else:
-            page.wait_for_timeout(wait_ms)
-        return page.content()
+            METRICS.incr("allowed_requests", 1, "host", stats_host)
+            await route.continue_()
+    return handle
+
+async def _wait_cards_stable(page, card_selector, budget_ms, poll_ms=250, stable_polls=2):
+    """Czeka, aż liczba kart przestanie rosnąć (stable_polls odczytów z rzędu) albo minie budżet."""
+    loop     = asyncio.get_running_loop()
+    deadline = loop.time() + budget_ms / 1000
+    last, stable = -1, 0
+    while loop.time() < deadline:
+        try:
+            count = await page.locator(card_selector).count()
+        except Exception:
+            count = 0
+        if count > 0 and count == last:
+            stable += 1
+            if stable >= stable_polls:
+                return count
+        else:
+            stable = 0
+        last = count
+        await asyncio.sleep(poll_ms / 1000)
+    return max(last, 0)
+
+def _pw_cache_key(url):
+    return "pw:" + url
+
+async def pw_get_html(page, url, card_selector=None, budget_ms=PW_RENDER_BUDGET_MS, force_render=False):
+    """Ładuje stronę Playwrightem i zwraca HTML, gdy tylko lista kart się ustabilizuje.
+
+    Nie czekamy na networkidle — reklamy i trackery potrafią ładować się dłużej niż same oferty.
+    Świeży (lub w trybie replay — dowolny) wyrenderowany HTML z cache zwracany jest bez przeglądarki,
+    chyba że force_render (i jest strona do renderowania).
+    """
+    if HTTP_CACHE and not (force_render and page is not None):
+        entry = HTTP_CACHE.load(_pw_cache_key(url))
+        if entry and (HTTP_CACHE_MODE == "replay" or HTTP_CACHE.is_fresh(entry)):
+            return entry["text"]
+        if HTTP_CACHE_MODE == "replay":
+            log.warning(f"[Cache] replay: brak {url}")
+            return ""
+    if page is None:
+        return ""
+    host = urlsplit(url).hostname or ""
+    try:
+        with METRICS.timer("render", "host", host):
+            t0   = time.perf_counter()
+            resp = await page.goto(url, wait_until="domcontentloaded", timeout=budget_ms + 15000)
+            left = max(1000, budget_ms - (time.perf_counter() - t0) * 1000)
+            if card_selector:
+                cards = await _wait_cards_stable(page, card_selector, left)
+                if not cards:
+                    METRICS.incr("render_budget_exhausted", 1, "host", host)
+            html = await page.content()
+        METRICS.http_response(host, resp.status if resp else "none", len(html))
+        if resp:
+            RATE_LIMITER.feedback(host, resp.status, html)
+        return html
     except Exception as e:
+        METRICS.http_response(host, "error", 0)
         log.warning(f"[Playwright] GET failed {url}: {e}")
         return ""
 
-def dismiss_cookie_banners(page):
+async def dismiss_cookie_banners(page):
     """Zamyka banery cookie żeby nie blokowały kliknięć."""
     for sel in [
         "button#onetrust-accept-btn-handler",
@@ -175,84 +2036,123 @@ def dismiss_cookie_banners(page):
         "#cookieAccept",
     ]:
         try:
-            btn = page.query_selector(sel)
-            if btn and btn.is_visible():
-                btn.click()
-                page.wait_for_timeout(500)
+            btn = await page.query_selector(sel)
+            if btn and await btn.is_visible():
+                await btn.click()
+                await page.wait_for_timeout(500)
                 break
         except Exception:
             pass
 
 
-# ─── 1. OTODOM ────────────────────────────────────────────────────────────────
+# ─── PORTAL REGISTRY ──────────────────────────────────────────────────────────
 
-def scrape_otodom(location_key, location):
-    log.info(f"[Otodom] {location_key}")
-    results = []
-    base_url = location["otodom_url"]
+# Portal to słownik konfiguracji: "fetch" — "requests" (generator "scrape" w puli wątków) albo
+# "playwright" (wspólny _pw_scrape_portal wg "cards"/"wait_sel"); adres startowy to
+# LOCATIONS[lokalizacja][url_key], paginacja — "pages" (+ "page_param"). "sorted_by_date" — wyniki
+# są posortowane od najnowszych, więc w trybie przyrostowym paginacja kończy się na stronie samych
+# znanych ofert (known_page). Nowy portal = nowy wpis.
+PORTALS = {}
 
-    for page_num in range(1, 6):
-        url = base_url if page_num == 1 else base_url + f"&page={page_num}"
-        r = get(url, referer="https://www.otodom.pl/")
-        if not r:
-            break
+def register_portal(source, **config):
+    """Dekorator scrapera requests: dopisuje portal do PORTALS; scraper dostaje swój wpis jako `portal`."""
+    def wrap(fn):
+        PORTALS[source] = {"source": source, "fetch": "requests", "scrape": fn, **config}
+        return fn
+    return wrap
 
-        soup   = BeautifulSoup(r.text, "html.parser")
-        script = soup.find("script", id="__NEXT_DATA__")
-        if not script:
-            log.warning(f"[Otodom] brak __NEXT_DATA__ str.{page_num}")
-            break
+def portal_name(portal):
+    """Krótka nazwa do CLI — jak klucz URL bez "_url" (otodom, nieruchomosci, ...)."""
+    return portal["url_key"].removesuffix("_url")
+
+
+# ─── 1. OTODOM ────────────────────────────────────────────────────────────────
+
+def parse_otodom_page(html, location_key, location):
+    """Parsuje stronę wyników Otodom (__NEXT_DATA__). None = brak danych, koniec paginacji."""
+    try:
+        data = extract_next_data(html)
+        if data is None:
+            log.warning("[Otodom] brak __NEXT_DATA__")
+            METRICS.incr("parse_errors", 1, "portal", "Otodom", location_key)
+            return None
+        props = data.get("props", {}).get("pageProps", {})
+        items = (props.get("data", {}).get("searchAds", {}).get("items", [])
+                 or props.get("listing", {}).get("results", [])
+                 or props.get("searchAdsResponse", {}).get("items", []))
+    except Exception as e:
+        log.warning(f"[Otodom] JSON: {e}")
+        METRICS.incr("parse_errors", 1, "portal", "Otodom", location_key)
+        return None
+
+    if not items:
+        return None
+    METRICS.incr("cards_found", len(items), "portal", "Otodom", location_key)
 
+    page_items = []
+    for item in items:
         try:
-            data  = json.loads(script.string)
-            props = data.get("props", {}).get("pageProps", {})
-            items = (props.get("data", {}).get("searchAds", {}).get("items", [])
-                     or props.get("listing", {}).get("results", [])
-                     or props.get("searchAdsResponse", {}).get("items", []))
-        except Exception as e:
-            log.warning(f"[Otodom] JSON: {e}")
-            break
+            price_raw = item.get("totalPrice") or item.get("price") or {}
+            price = price_raw.get("value") if isinstance(price_raw, dict) else price_raw
 
-        if not items:
-            break
+            area = item.get("areaInSquareMeters") or item.get("area")
+            if isinstance(area, list):
+                area = area[0] if area else None
 
-        for item in items:
-            try:
-                price_raw = item.get("totalPrice") or item.get("price") or {}
-                price = price_raw.get("value") if isinstance(price_raw, dict) else price_raw
+            images = []
+            for img in (item.get("images") or item.get("photos") or [])[:6]:
+                src = (img.get("large") or img.get("medium") or img.get("small")
+                       or img.get("src") or (img if isinstance(img, str) else None))
+                if src:
+                    images.append(src)
 
-                area = item.get("areaInSquareMeters") or item.get("area")
-                if isinstance(area, list):
-                    area = area[0] if area else None
+            slug = item.get("slug") or item.get("id", "")
+            link = f"https://www.otodom.pl/pl/oferta/{slug}" if slug else ""
 
-                images = []
-                for img in (item.get("images") or item.get("photos") or [])[:6]:
-                    src = (img.get("large") or img.get("medium") or img.get("small")
-                           or img.get("src") or (img if isinstance(img, str) else None))
-                    if src:
-                        images.append(src)
+            loc  = item.get("locationLabel") or item.get("location") or {}
+            city = (loc.get("value") or loc.get("name") or item.get("city", "")) if isinstance(loc, dict) else str(loc)
 
-                slug = item.get("slug") or item.get("id", "")
-                link = f"https://www.otodom.pl/pl/oferta/{slug}" if slug else ""
+            check = f"{city} {item.get('title','')} {link}"
+            if not is_in_location(check, location_key):
+                continue
 
-                loc  = item.get("locationLabel") or item.get("location") or {}
-                city = (loc.get("value") or loc.get("name") or item.get("city", "")) if isinstance(loc, dict) else str(loc)
+            page_items.append(make_item(
+                "Otodom", location, location_key,
+                item.get("title"), price, area, city,
+                item.get("shortDescription", ""), images, link,
+            ))
+        except Exception as e:
+            log.debug(f"[Otodom] item: {e}")
+            METRICS.incr("parse_errors", 1, "portal", "Otodom", location_key)
+    METRICS.incr("cards_accepted", len(page_items), "portal", "Otodom", location_key)
+    return page_items
 
-                check = f"{city} {item.get('title','')} {link}"
-                if not is_in_location(check, location_key):
-                    continue
 
-                results.append(make_item(
-                    "Otodom", location, location_key,
-                    item.get("title"), price, area, city,
-                    item.get("shortDescription", ""), images, link,
-                ))
-            except Exception as e:
-                log.debug(f"[Otodom] item: {e}")
-        sleep()
+@register_portal("Otodom", url_key="otodom_url", pages=5, page_param="&page=",
+                 referer="https://www.otodom.pl/")
+def scrape_otodom(portal, location_key, location, skip=0):
+    log.info(f"[Otodom] {location_key}")
+    total    = 0
+    base_url = location[portal["url_key"]]
 
-    log.info(f"[Otodom] {location_key}: {len(results)}")
-    return results
+    for page_num in range(1 + skip, portal["pages"] + 1):
+        url = base_url if page_num == 1 else base_url + f"{portal['page_param']}{page_num}"
+        r = get(url, referer=portal["referer"])
+        if not r:
+            break
+
+        page_items = cached_parse(r, "Otodom", location_key, parse_otodom_page, location_key, location)
+        if page_items is None:
+            log.info(f"[Otodom] str.{page_num}: brak danych, koniec")
+            break
+
+        total += len(page_items)
+        yield page_items
+        if known_page(portal, page_items):
+            log.info(f"[Otodom] str.{page_num}: same znane oferty, koniec")
+            break
+
+    log.info(f"[Otodom] {location_key}: {total}")
 
 
 # ─── 2. OLX (API) ────────────────────────────────────────────────────────────
@@ -262,19 +2162,71 @@ OLX_API_IDS = {
     "zakopane": {"category_id": 1389, "region_id": 15,  "city_id": 145283, "dist": 20},
 }
 
-def scrape_olx(location_key, location):
+def parse_olx_offers(offers, location_key, location):
+    """Zamienia listę ofert z API OLX na rekordy make_item."""
+    METRICS.incr("cards_found", len(offers), "portal", "OLX", location_key)
+    page_items = []
+    for offer in offers:
+        try:
+            title = offer.get("title", "Działka")
+            link  = offer.get("url", "")
+            if link and not link.startswith("http"):
+                link = "https://www.olx.pl" + link
+
+            price = None
+            pi = offer.get("price") or {}
+            if isinstance(pi, dict):
+                price = parse_price(str(pi.get("value", "") or ""))
+
+            loc  = offer.get("location") or {}
+            city = ((loc.get("city") or {}).get("name", "") if isinstance(loc.get("city"), dict)
+                    else loc.get("city", "") or loc.get("name", ""))
+
+            images = []
+            for ph in (offer.get("photos") or offer.get("images") or [])[:6]:
+                src = ph.get("link") or ph.get("url") or (ph if isinstance(ph, str) else "")
+                if src and src.startswith("http"):
+                    images.append(src)
+
+            area = None
+            for param in offer.get("params", []):
+                if param.get("key") in ("surface", "area", "m2"):
+                    area = parse_area(str(param.get("value", {}).get("key", "") if isinstance(param.get("value"), dict) else param.get("value", "")))
+                    if area:
+                        break
+
+            desc = (offer.get("description") or "")[:300]
+
+            check = f"{city} {title} {link}"
+            if not is_in_location(check, location_key):
+                continue
+
+            page_items.append(make_item("OLX", location, location_key, title, price, area, city, desc, images, link))
+        except Exception as e:
+            log.debug(f"[OLX] item: {e}")
+            METRICS.incr("parse_errors", 1, "portal", "OLX", location_key)
+    METRICS.incr("cards_accepted", len(page_items), "portal", "OLX", location_key)
+    return page_items
+
+
+# OLX idzie przez API (OLX_API_IDS), a olx_url z LOCATIONS służy tylko do nazwy w CLI
+@register_portal("OLX", url_key="olx_url", pages=5, page_size=40, sorted_by_date=True,
+                 api_url="https://www.olx.pl/api/v1/offers/")
+def scrape_olx(portal, location_key, location, skip=0):
     log.info(f"[OLX] {location_key}")
-    results = []
-    p = OLX_API_IDS[location_key]
+    total = 0
+    p     = OLX_API_IDS[location_key]
+    size  = portal["page_size"]
 
-    for offset in range(0, 200, 40):
-        url = (f"https://www.olx.pl/api/v1/offers/"
+    for offset in range(size * skip, size * portal["pages"], size):
+        url = (f"{portal['api_url']}"
                f"?category_id={p['category_id']}&region_id={p['region_id']}"
                f"&city_id={p['city_id']}&dist={p['dist']}"
-               f"&sort_by=created_at%3Adesc&offset={offset}&limit=40")
+               f"&sort_by=created_at%3Adesc&offset={offset}&limit={size}")
+        r = get(url, accept="application/json", pace=(1, 2))
+        if not r:
+            break
         try:
-            r = requests.get(url, headers={**HEADERS, "Accept": "application/json"}, timeout=25)
-            r.raise_for_status()
             data = r.json()
         except Exception as e:
             log.warning(f"[OLX API] offset={offset}: {e}")
@@ -284,107 +2236,99 @@ def scrape_olx(location_key, location):
         if not offers:
             break
 
-        for offer in offers:
-            try:
-                title = offer.get("title", "Działka")
-                link  = offer.get("url", "")
-                if link and not link.startswith("http"):
-                    link = "https://www.olx.pl" + link
-
-                price = None
-                pi = offer.get("price") or {}
-                if isinstance(pi, dict):
-                    price = parse_price(str(pi.get("value", "") or ""))
-
-                loc  = offer.get("location") or {}
-                city = ((loc.get("city") or {}).get("name", "") if isinstance(loc.get("city"), dict)
-                        else loc.get("city", "") or loc.get("name", ""))
-
-                images = []
-                for ph in (offer.get("photos") or offer.get("images") or [])[:6]:
-                    src = ph.get("link") or ph.get("url") or (ph if isinstance(ph, str) else "")
-                    if src and src.startswith("http"):
-                        images.append(src)
-
-                area = None
-                for param in offer.get("params", []):
-                    if param.get("key") in ("surface", "area", "m2"):
-                        area = parse_area(str(param.get("value", {}).get("key", "") if isinstance(param.get("value"), dict) else param.get("value", "")))
-                        if area:
-                            break
-
-                desc = (offer.get("description") or "")[:300]
-
-                check = f"{city} {title} {link}"
-                if not is_in_location(check, location_key):
-                    continue
-
-                results.append(make_item("OLX", location, location_key, title, price, area, city, desc, images, link))
-            except Exception as e:
-                log.debug(f"[OLX] item: {e}")
+        page_items = parse_olx_offers(offers, location_key, location)
+        total += len(page_items)
+        yield page_items
+        # OLX sortuje po created_at:desc — za stroną znanych ofert są już tylko starsze
+        if known_page(portal, page_items):
+            log.info(f"[OLX] offset={offset}: same znane oferty, koniec")
+            break
 
         if not data.get("links", {}).get("next"):
             break
-        sleep(1, 2)
 
-    log.info(f"[OLX] {location_key}: {len(results)}")
-    return results
+    log.info(f"[OLX] {location_key}: {total}")
 
 
 # ─── 3. DOMIPORTA (requests) ─────────────────────────────────────────────────
 
-def scrape_domiporta(location_key, location):
-    log.info(f"[Domiporta] {location_key}")
-    results = []
+DOMIPORTA_CARDS = [".sneakpeak", "li.listing__item", ".listing-item"]
 
-    for page_num in range(1, 8):
-        base = location["domiporta_url"]
-        url  = base if page_num == 1 else base + f"?PageNumber={page_num}"
-        r    = get(url, referer="https://www.domiporta.pl/")
-        if not r:
-            break
-        soup  = BeautifulSoup(r.text, "html.parser")
-        cards = soup.select(".sneakpeak") or soup.select("li.listing__item") or soup.select(".listing-item")
-        if not cards:
+def parse_domiporta_page(html, location_key, location):
+    """Parsuje stronę wyników Domiporta. None = brak kart, koniec paginacji."""
+    soup  = BeautifulSoup(html, HTML_PARSER, parse_only=card_strainer(DOMIPORTA_CARDS))
+    cards = []
+    for sel in DOMIPORTA_CARDS:
+        cards = soup.select(sel)
+        if cards:
             break
+    if not cards:
+        return None
+    METRICS.incr("cards_found", len(cards), "portal", "Domiporta", location_key)
 
-        for card in cards:
-            try:
-                a    = card.find("a", href=True)
-                link = a["href"] if a else ""
-                if link and not link.startswith("http"):
-                    link = "https://www.domiporta.pl" + link
+    page_items = []
+    for card in cards:
+        try:
+            a    = card.find("a", href=True)
+            link = a["href"] if a else ""
+            if link and not link.startswith("http"):
+                link = "https://www.domiporta.pl" + link
 
-                title_el = card.select_one(".sneakpeak__title") or card.select_one("[class*='title']") or card.find("h2") or card.find("h3")
-                title    = title_el.get_text(strip=True) if title_el else "Działka"
+            title_el = card.select_one(".sneakpeak__title") or card.select_one("[class*='title']") or card.find("h2") or card.find("h3")
+            title    = title_el.get_text(strip=True) if title_el else "Działka"
 
-                price_el = card.select_one(".sneakpeak__price") or card.select_one("[class*='price']")
-                price    = parse_price(price_el.get_text() if price_el else "")
+            price_el = card.select_one(".sneakpeak__price") or card.select_one("[class*='price']")
+            price    = parse_price(price_el.get_text() if price_el else "")
 
-                img_el = card.find("img")
-                images = []
-                if img_el:
-                    src = img_el.get("data-src") or img_el.get("data-lazy") or img_el.get("src")
-                    if src and src.startswith("http"):
-                        images = [src]
+            img_el = card.find("img")
+            images = []
+            if img_el:
+                src = img_el.get("data-src") or img_el.get("data-lazy") or img_el.get("src")
+                if src and src.startswith("http"):
+                    images = [src]
 
-                loc_el = card.select_one(".sneakpeak__location") or card.select_one("[class*='location']")
-                city   = loc_el.get_text(strip=True) if loc_el else ""
+            loc_el = card.select_one(".sneakpeak__location") or card.select_one("[class*='location']")
+            city   = loc_el.get_text(strip=True) if loc_el else ""
 
-                area_el = card.select_one("[class*='area']") or card.select_one("[class*='powierzch']")
-                area    = parse_area(area_el.get_text() if area_el else "") or parse_area(title)
+            area_el = card.select_one("[class*='area']") or card.select_one("[class*='powierzch']")
+            area    = parse_area(area_el.get_text() if area_el else "") or parse_area(title)
 
-                check = f"{city} {title} {link}"
-                if not is_in_location(check, location_key):
-                    continue
+            check = f"{city} {title} {link}"
+            if not is_in_location(check, location_key):
+                continue
 
-                results.append(make_item("Domiporta", location, location_key, title, price, area, city, "", images, link))
-            except Exception as e:
-                log.debug(f"[Domiporta] item: {e}")
-        sleep()
+            page_items.append(make_item("Domiporta", location, location_key, title, price, area, city, "", images, link))
+        except Exception as e:
+            log.debug(f"[Domiporta] item: {e}")
+            METRICS.incr("parse_errors", 1, "portal", "Domiporta", location_key)
+    METRICS.incr("cards_accepted", len(page_items), "portal", "Domiporta", location_key)
+    return page_items
 
-    log.info(f"[Domiporta] {location_key}: {len(results)}")
-    return results
+
+@register_portal("Domiporta", url_key="domiporta_url", pages=7, page_param="?PageNumber=",
+                 referer="https://www.domiporta.pl/")
+def scrape_domiporta(portal, location_key, location, skip=0):
+    log.info(f"[Domiporta] {location_key}")
+    total = 0
+    base  = location[portal["url_key"]]
+
+    for page_num in range(1 + skip, portal["pages"] + 1):
+        url  = base if page_num == 1 else base + f"{portal['page_param']}{page_num}"
+        r    = get(url, referer=portal["referer"])
+        if not r:
+            break
+
+        page_items = cached_parse(r, "Domiporta", location_key, parse_domiporta_page, location_key, location)
+        if page_items is None:
+            break
+
+        total += len(page_items)
+        yield page_items
+        if known_page(portal, page_items):
+            log.info(f"[Domiporta] str.{page_num}: same znane oferty, koniec")
+            break
+
+    log.info(f"[Domiporta] {location_key}: {total}")
 
 
 # ─── PLAYWRIGHT SCRAPERS ──────────────────────────────────────────────────────
@@ -392,7 +2336,8 @@ def scrape_domiporta(location_key, location):
 def _pw_parse_cards(html, source, location, location_key, card_selectors, base_domain):
     """Wspólny parser HTML po Playwright dla różnych portali."""
     results = []
-    soup    = BeautifulSoup(html, "html.parser")
+    # Budujemy drzewo tylko dla kontenerów kart — reszta strony (skrypty, menu, stopka) jest pomijana
+    soup    = BeautifulSoup(html, HTML_PARSER, parse_only=card_strainer(card_selectors))
 
     cards = []
     for sel in card_selectors:
@@ -403,6 +2348,7 @@ def _pw_parse_cards(html, source, location, location_key, card_selectors, base_d
     if not cards:
         # Wypisz dostępne klasy żeby znaleźć właściwy selektor
         log.warning(f"[{source}] brak kart w HTML ({len(html)} znaków)")
+        soup = BeautifulSoup(html, HTML_PARSER)
         all_classes = []
         for tag in soup.find_all(["article", "li", "div", "section"], class_=True)[:80]:
             for c in tag.get("class", []):
@@ -410,6 +2356,7 @@ def _pw_parse_cards(html, source, location, location_key, card_selectors, base_d
                     all_classes.append(c)
         log.warning(f"[{source}] klasy elementów: {sorted(all_classes)[:50]}")
         return results
+    METRICS.incr("cards_found", len(cards), "portal", source, location_key)
 
     for card in cards:
         try:
@@ -455,119 +2402,309 @@ def _pw_parse_cards(html, source, location, location_key, card_selectors, base_d
             results.append(make_item(source, location, location_key, title, price, area, city, "", images, link))
         except Exception as e:
             log.debug(f"[{source}] item: {e}")
+            METRICS.incr("parse_errors", 1, "portal", source, location_key)
 
+    METRICS.incr("cards_accepted", len(results), "portal", source, location_key)
     return results
 
 
-def scrape_with_playwright(location_key, location, pw_browser):
-    """Scrape portale JS: Gratka, N-online, Adresowo, Morizon."""
-    results = []
-    context = pw_browser.new_context(
-        user_agent=HEADERS["User-Agent"],
-        locale="pl-PL",
-        viewport={"width": 1280, "height": 800},
-    )
-    page = context.new_page()
-    # Blokuj zbędne zasoby (reklamy, fonty) — szybsze ładowanie
-    page.route("**/*.{png,jpg,jpeg,gif,svg,woff,woff2,ttf,otf}", lambda r: r.abort())
-    page.route("**/{ads,analytics,tracking,gtm,facebook,hotjar}**", lambda r: r.abort())
-
-    portals = [
-        {
-            "source":   "Gratka",
-            "url_key":  "gratka_url",
-            "domain":   "https://gratka.pl",
-            # Gratka: oferty są w article z data-url lub .listing__item
-            "wait_sel": "article[data-url], .listing__item, .offer-item",
-            "cards":    ["article[data-url]", ".listing__item", ".offer-item", "article.offer", "[data-url]"],
-            "pages":    4,
-            "page_param": "&page=",
-        },
-        {
-            "source":   "Nieruchomosci-online",
-            "url_key":  "nieruchomosci_url",
-            "domain":   "https://www.nieruchomosci-online.pl",
-            # N-online: oferty w .box__us lub article lub .grid li
-            "wait_sel": ".box__us, .property-list-item, .offer-item",
-            "cards":    [".property-list-item", ".box__us--cta", ".box__us", ".offer-item", "article"],
-            "pages":    4,
-            "page_param": "&page=",
-        },
-        {
-            "source":   "Adresowo",
-            "url_key":  "adresowo_url",
-            "domain":   "https://adresowo.pl",
-            # Adresowo blokuje cookie bannerem cky-* — trzeba go zamknąć
-            "wait_sel": ".property-box, .offer-box, article, .flat-box",
-            "cards":    [".property-box", ".offer-box", ".flat-box", "article.offer", ".listing-item", "article"],
-            "pages":    4,
-            "page_param": "?page=",
-            "dismiss_cookie": True,
-        },
-        {
-            "source":   "Morizon",
-            "url_key":  "morizon_url",
-            "domain":   "https://www.morizon.pl",
-            # Morizon: klasa card jest! Szukamy card z linkiem do oferty
-            "wait_sel": ".card, .offer-item, [class*='listing']",
-            "cards":    [".card.card--border", ".card", ".offer-item", "[class*='offerCard']"],
-            "pages":    4,
-            "page_param": "?page=",
-        },
-    ]
+def _pw_parse_page(text, source, location, location_key, card_selectors, base_domain):
+    """Strona portalu JS: najpierw dane strukturalne (stan strony / JSON z API), potem selektory CSS.
 
-    for portal in portals:
-        source  = portal["source"]
-        base_url = location[portal["url_key"]]
-        log.info(f"[{source}] {location_key} (Playwright)")
+    Zwraca {"via": "state" | "cards", "items": [...]} — `via` mówi, czy następne strony
+    można pobierać zwykłym HTTP bez renderowania.
+    """
+    if text.lstrip()[:1] in ("{", "["):
+        try:
+            blobs = [json.loads(text)]
+        except ValueError:
+            blobs = []
+        return {"via": "state", "items": parse_json_listings(blobs, source, location, location_key, base_domain)[0]}
+    items, found = parse_json_listings(extract_state_blobs(text), source, location, location_key, base_domain)
+    if found:
+        return {"via": "state", "items": items}
+    return {"via": "cards", "items": _pw_parse_cards(text, source, location, location_key, card_selectors, base_domain)}
+
+PAGE_PARAMS = ("page", "p", "pageNumber", "currentPage", "pageIndex", "strona")
+
+def _api_page_url(url, pg):
+    """Adres strony `pg` endpointu JSON podejrzanego na stronie 1; None, gdy nie widać parametru strony."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    keys  = [k for k, _ in query]
+    for name in PAGE_PARAMS:
+        if name in keys:
+            first = dict(query)[name]
+            value = pg - 1 if first == "0" else pg
+            query = [(k, str(value) if k == name else v) for k, v in query]
+            return parts._replace(query=urlencode(query)).geturl()
+    for offset, size in (("offset", "limit"), ("from", "size"), ("start", "rows")):
+        if offset in keys and size in keys and dict(query)[size].isdigit():
+            value = (pg - 1) * int(dict(query)[size])
+            query = [(k, str(value) if k == offset else v) for k, v in query]
+            return parts._replace(query=urlencode(query)).geturl()
+    return None
 
-        portal_results = []
+def _direct_key(source, location_key):
+    return f"direct:{source}:{location_key}"
+
+PW_PORTALS = [
+    {
+        "source":   "Gratka",
+        "url_key":  "gratka_url",
+        "domain":   "https://gratka.pl",
+        # Gratka: oferty są w article z data-url lub .listing__item
+        "wait_sel": "article[data-url], .listing__item, .offer-item",
+        "cards":    ["article[data-url]", ".listing__item", ".offer-item", "article.offer", "[data-url]"],
+        "pages":    4,
+        "page_param": "&page=",
+        "render_budget_ms": 12000,
+    },
+    {
+        "source":   "Nieruchomosci-online",
+        "url_key":  "nieruchomosci_url",
+        "domain":   "https://www.nieruchomosci-online.pl",
+        # N-online: oferty w .box__us lub article lub .grid li
+        "wait_sel": ".box__us, .property-list-item, .offer-item",
+        "cards":    [".property-list-item", ".box__us--cta", ".box__us", ".offer-item", "article"],
+        "pages":    4,
+        "page_param": "&page=",
+        "render_budget_ms": 12000,
+    },
+    {
+        "source":   "Adresowo",
+        "url_key":  "adresowo_url",
+        "domain":   "https://adresowo.pl",
+        # Adresowo blokuje cookie bannerem cky-* — trzeba go zamknąć
+        "wait_sel": ".property-box, .offer-box, article, .flat-box",
+        "cards":    [".property-box", ".offer-box", ".flat-box", "article.offer", ".listing-item", "article"],
+        "pages":    4,
+        "page_param": "?page=",
+        "dismiss_cookie": True,
+        "render_budget_ms": 18000,
+    },
+    {
+        "source":   "Morizon",
+        "url_key":  "morizon_url",
+        "domain":   "https://www.morizon.pl",
+        # Morizon: klasa card jest! Szukamy card z linkiem do oferty
+        "wait_sel": ".card, .offer-item, [class*='listing']",
+        "cards":    [".card.card--border", ".card", ".offer-item", "[class*='offerCard']"],
+        "pages":    4,
+        "page_param": "?page=",
+        "render_budget_ms": 12000,
+    },
+]
+for _portal in PW_PORTALS:
+    PORTALS[_portal["source"]] = {"fetch": "playwright", **_portal}
+
+async def _pw_scrape_portal(context, portal, location_key, location, skip=0):
+    """Przechodzi strony jednego portalu dla jednej lokalizacji w podanym kontekście i oddaje je po kolei.
+
+    `context` może być None w trybie replay — strony czytane są wtedy wyłącznie z cache.
+    """
+    source   = portal["source"]
+    base_url = location[portal["url_key"]]
+    log.info(f"[{source}] {location_key} (Playwright)")
+
+    budget = portal.get("render_budget_ms", PW_RENDER_BUDGET_MS)
+    page   = None
+    if context is not None:
+        page = await context.new_page()
+        await page.route("**/*", _pw_router(portal))
+
+    # Tryb bezpośredni: {"kind": "state"} — stan strony jest w HTML z serwera,
+    # {"kind": "api", "url": ...} — lista przychodzi z endpointu JSON; zapamiętany w bazie między przebiegami
+    direct = None
+    if STORE is not None:
+        direct = json.loads(STORE.get_meta(_direct_key(source, location_key), "null"))
+    parse_args = (source, location, location_key, portal["cards"], portal["domain"])
+
+    def page_url(pg):
+        return base_url if pg == 1 else base_url + portal["page_param"] + str(pg)
+
+    async def fetch_direct(pg):
+        if direct["kind"] == "api":
+            url = _api_page_url(direct["url"], pg)
+            if url is None:
+                return []
+            accept = "application/json"
+        else:
+            url, accept = page_url(pg), None
+        r = await asyncio.to_thread(get, url, base_url, accept, (2, 5))
+        if not r:
+            return []
+        parsed = await asyncio.to_thread(cached_parse, r, source, location_key, _pw_parse_page, *parse_args)
+        return parsed["items"] if parsed["via"] == "state" else []
+
+    async def capture_api(responses):
+        """Szuka wśród odpowiedzi XHR/fetch tej, która zawiera listę ofert."""
+        for resp in responses:
+            try:
+                body = await resp.text()
+            except Exception:
+                continue
+            if body.lstrip()[:1] not in ("{", "["):
+                continue
+            parsed = await asyncio.to_thread(run_parser, _pw_parse_page, body, *parse_args)
+            if parsed["items"]:
+                return resp.url, parsed["items"]
+        return None, []
+
+    async def fetch_and_parse(url, first, force_render=False):
+        cached = HTTP_CACHE.load(_pw_cache_key(url)) if HTTP_CACHE else None
+        render = page is not None and (force_render or not (cached and HTTP_CACHE.is_fresh(cached)))
+
+        responses = []
+        def on_response(resp):
+            if resp.request.method == "GET" and resp.request.resource_type in ("xhr", "fetch") \
+                    and "json" in resp.headers.get("content-type", ""):
+                responses.append(resp)
+        if render:
+            await apolite_wait(url, 2, 5)
+            if first:
+                page.on("response", on_response)
+        html = await pw_get_html(page if render else None, url, portal["wait_sel"], budget, force_render)
+
+        if first and render:
+            # Zawsze próbuj zamknąć banery cookie; po zamknięciu lista może się doładować
+            await dismiss_cookie_banners(page)
+            await _wait_cards_stable(page, portal["wait_sel"], 12000 if portal.get("dismiss_cookie") else 3000)
+            try:
+                html = await page.content()  # odśwież po zamknięciu bannera
+            except Exception as e:
+                log.warning(f"[{source}] content: {e}")
+            page.remove_listener("response", on_response)
+
+        r = CachedResponse(url, 200, html, from_cache=not render, unchanged=not render)
+        if render and cached:
+            r.unchanged = cached.get("hash") == r.content_hash
+
+        # Parsowanie poza pętlą zdarzeń, żeby nie wstrzymywać renderowania innych kart
+        parsed = await asyncio.to_thread(cached_parse, r, source, location_key, _pw_parse_page, *parse_args)
+        if render:
+            METRICS.incr("pages_rendered", 1, "portal", source, location_key)
+            # Render bez kart (zablokowane skrypty, CAPTCHA) nie trafia do cache — inaczej ponowienie
+            # i kolejne uruchomienia w czasie TTL czytałyby ten sam pusty HTML
+            if parsed["items"] and HTTP_CACHE:
+                HTTP_CACHE.store(_pw_cache_key(url), html)
+        mode = {"kind": "state"} if parsed["via"] == "state" and parsed["items"] else None
+        if mode is None and responses:
+            api_url, api_items = await capture_api(responses)
+            if api_items and _api_page_url(api_url, 2):
+                mode = {"kind": "api", "url": api_url}
+                if not parsed["items"]:
+                    parsed["items"] = api_items
+        return parsed["items"], render, mode
+
+    total = 0
+    t0    = time.perf_counter()
+    try:
+        for pg in range(1 + skip, portal["pages"] + 1):
+            url    = page_url(pg)
+            first  = pg == 1 + skip
+            items  = []
+            missed = False
+            if direct:
+                items = await fetch_direct(pg)
+                if items:
+                    METRICS.incr("pages_direct", 1, "portal", source, location_key)
+                else:
+                    # Koniec wyników albo endpoint się zmienił — rozstrzygnie render tej strony
+                    missed, direct = True, None
+
+            if not items:
+                items, rendered, mode = await fetch_and_parse(url, first)
+                if not items and rendered and first and source not in _PW_RELAXED:
+                    # Być może portal potrzebuje skryptów z innej domeny — ponów, blokując tylko trackery
+                    log.info(f"[{source}] brak kart przy blokowaniu skryptów zewnętrznych, ponawiam")
+                    _PW_RELAXED.add(source)
+                    items, _, mode = await fetch_and_parse(url, True, force_render=True)
+                    if items:
+                        METRICS.incr("render_relaxed", 1, "portal", source, location_key)
+                    else:
+                        # Pusta strona także bez blokady — to nie skrypty, wracamy do pełnego blokowania
+                        _PW_RELAXED.discard(source)
+                if missed and (items or first):
+                    log.info(f"[{source}] tryb bezpośredni nie działa dla {location_key} str.{pg}, wracam do renderowania")
+                    METRICS.incr("direct_misses", 1, "portal", source, location_key)
+                    if STORE is not None:
+                        STORE.set_meta(_direct_key(source, location_key), "null")
+                if mode and first:
+                    log.info(f"[{source}] {location_key}: dalsze strony bez renderowania ({mode['kind']})")
+                    direct = mode
+                    if STORE is not None:
+                        STORE.set_meta(_direct_key(source, location_key), json.dumps(mode))
 
-        for pg in range(1, portal["pages"] + 1):
-            if pg == 1:
-                url = base_url
-            else:
-                sep = portal["page_param"]
-                url = base_url + sep + str(pg)
-
-            html = pw_get_html(page, url, wait_selector=portal["wait_sel"], wait_ms=6000)
-
-            if pg == 1:
-                # Zawsze próbuj zamknąć banery cookie
-                dismiss_cookie_banners(page)
-                page.wait_for_timeout(1500)
-                # Dla portali z cookie bannerem czekaj na właściwy selektor
-                if portal.get("dismiss_cookie"):
-                    try:
-                        page.wait_for_selector(portal["wait_sel"], timeout=12000)
-                    except PWTimeout:
-                        pass
-                html = page.content()  # odśwież po zamknięciu bannera
-
-            items = _pw_parse_cards(html, source, location, location_key, portal["cards"], portal["domain"])
             if not items:
                 log.info(f"[{source}] brak wyników str.{pg}, koniec")
                 break
 
-            portal_results.extend(items)
+            total += len(items)
             log.info(f"[{source}] str.{pg}: +{len(items)}")
-            sleep(2, 5)
-
-        log.info(f"[{source}] {location_key}: {len(portal_results)}")
-        results.extend(portal_results)
-
-    page.close()
-    context.close()
-    return results
-
-
-# ─── MAIN ─────────────────────────────────────────────────────────────────────
-
-def main():
-    all_results = []
-
-    with sync_playwright() as pw:
-        browser = pw.chromium.launch(
+            yield items
+            if known_page(portal, items):
+                log.info(f"[{source}] str.{pg}: same znane oferty, koniec")
+                break
+    finally:
+        METRICS.add_time("job", time.perf_counter() - t0, "portal", source, location_key)
+        if page is not None:
+            await page.close()
+
+    log.info(f"[{source}] {location_key}: {total}")
+
+
+async def scrape_with_playwright(locations, pw_browser, sink, frontier, portals=None, pool_size=PW_POOL_SIZE):
+    """Scrape portale JS (`portals`, domyślnie wszystkie z PW_PORTALS).
+
+    Każda para portal × lokalizacja to osobne zadanie; zadania dzielą pulę `pool_size`
+    kontekstów jednej przeglądarki. Każda strona ofert trafia od razu do `sink`,
+    a postęp do `frontier` — zakończone w przerwanym przebiegu pary są pomijane.
+    """
+    def checkpoint(source, loc_key, items):
+        sink.add(items)
+        frontier.page_done(source, loc_key, len(items))
+
+    contexts = asyncio.Queue()
+    for _ in range(max(1, pool_size)):
+        contexts.put_nowait(await pw_browser.new_context(
+            user_agent=HEADERS["User-Agent"],
+            locale="pl-PL",
+            viewport={"width": 1280, "height": 800},
+        ) if pw_browser else None)
+
+    async def run(portal, loc_key, loc_data):
+        source = portal["source"]
+        skip   = frontier.start(source, loc_key)
+        if skip is None:
+            return
+        context = await contexts.get()
+        try:
+            async for items in _pw_scrape_portal(context, portal, loc_key, loc_data, skip):
+                await asyncio.to_thread(checkpoint, source, loc_key, items)
+            frontier.unit_done(source, loc_key)
+        except Exception as e:
+            log.error(f"[{portal['source']}] Playwright failed for {loc_key}: {e}")
+        finally:
+            contexts.put_nowait(context)
+
+    await asyncio.gather(*(run(portal, loc_key, locations[loc_key])
+                           for loc_key in locations for portal in (PW_PORTALS if portals is None else portals)))
+
+    while not contexts.empty():
+        context = contexts.get_nowait()
+        if context is not None:
+            await context.close()
+
+
+async def run_playwright_stage(locations, sink, frontier, portals=None):
+    """Uruchamia jeden Chromium i scrapuje nim portale JS (`portals`, domyślnie wszystkie)."""
+    if HTTP_CACHE_MODE == "replay":
+        return await scrape_with_playwright(locations, None, sink, frontier, portals)
+    # Import dopiero tutaj — przebieg bez portali JS nie ładuje Playwrighta ani nie startuje Chromium
+    from playwright.async_api import async_playwright
+    async with async_playwright() as pw:
+        browser = await pw.chromium.launch(
             headless=True,
             args=[
                 "--no-sandbox",
@@ -576,40 +2713,171 @@ def main():
                 "--disable-blink-features=AutomationControlled",
             ]
         )
+        try:
+            return await scrape_with_playwright(locations, browser, sink, frontier, portals)
+        finally:
+            await browser.close()
 
-        for loc_key, loc_data in LOCATIONS.items():
-            log.info(f"\n{'='*50}")
-            log.info(f"LOKALIZACJA: {loc_data['label']}")
-            log.info(f"{'='*50}")
 
-            # Szybkie scrapery (requests)
-            for fn in [scrape_otodom, scrape_olx, scrape_domiporta]:
-                try:
-                    items = fn(loc_key, loc_data)
-                    all_results.extend(items)
-                except Exception as e:
-                    log.error(f"{fn.__name__} failed: {e}")
+# ─── MAIN ─────────────────────────────────────────────────────────────────────
 
-            # Portale JS (Playwright)
+def _run_job(portal, loc_key, loc_data, sink, frontier):
+    """Przepuszcza strony z generatora scrapera do `sink` zaraz po ich sparsowaniu, odnotowując postęp."""
+    source = portal["source"]
+    skip   = frontier.start(source, loc_key)
+    if skip is None:
+        return
+    try:
+        with METRICS.timer("job", "portal", source, loc_key):
+            for page_items in portal["scrape"](portal, loc_key, loc_data, skip):
+                sink.add(page_items)
+                frontier.page_done(source, loc_key, len(page_items))
+        frontier.unit_done(source, loc_key)
+    except Exception as e:
+        log.error(f"{portal['scrape'].__name__} failed for {loc_key}: {e}")
+        METRICS.incr("job_errors", 1, "portal", source, loc_key)
+
+def parse_cli(argv=None):
+    """Argumenty wiersza poleceń → (lista wpisów PORTALS, słownik wybranych LOCATIONS, katalog wyjściowy)."""
+    names = {portal_name(p): p for p in PORTALS.values()}
+    ap = argparse.ArgumentParser(description="Scraper działek — portale requests i Playwright")
+    ap.add_argument("-p", "--portals", nargs="+", metavar="PORTAL", choices=list(names),
+                    help=f"portale do uruchomienia (domyślnie wszystkie): {', '.join(names)}")
+    ap.add_argument("-l", "--locations", nargs="+", metavar="LOC", choices=list(LOCATIONS),
+                    help=f"lokalizacje (domyślnie wszystkie): {', '.join(LOCATIONS)}")
+    ap.add_argument("--fetch", choices=["requests", "playwright"],
+                    help="tylko portale danego typu — 'requests' to szybkie odświeżenie bez Chromium")
+    ap.add_argument("--out-dir", type=Path,
+                    help="katalog strony: data.json, data/, thumbs/, changes.json (domyślnie docs/; "
+                         "w trybie SCRAPER_CACHE=replay wymagany)")
+    args = ap.parse_args(argv)
+    if args.out_dir is None:
+        # Replay to strojenie parserów na starym cache — jego wynik nie może nadpisać strony
+        # ani dopisać do changes.json/feed.xml zmian, których na portalach nie było
+        if HTTP_CACHE_MODE == "replay":
+            ap.error("tryb replay wymaga --out-dir (katalogu innego niż docs/)")
+        args.out_dir = Path(__file__).parent.parent / "docs"
+
+    portals = [names[n] for n in args.portals] if args.portals else list(PORTALS.values())
+    portals = [p for p in portals if args.fetch in (None, p["fetch"])]
+    if not portals:
+        ap.error("wybór nie obejmuje żadnego portalu")
+    locations = {k: LOCATIONS[k] for k in (args.locations or LOCATIONS)}
+    return portals, locations, args.out_dir
+
+def main(argv=None):
+    global STORE, HTTP_CACHE, PARSE_POOL
+    portals, locations, out_dir = parse_cli(argv)
+    out_path    = out_dir / "data.json"
+    run_started = datetime.utcnow().isoformat()
+    # Przebieg częściowy (wybrane portale/lokalizacje) nie liczy się jako pełny i nie otwiera wznawialnego
+    full_run    = len(portals) == len(PORTALS) and len(locations) == len(LOCATIONS)
+    req_portals = [p for p in portals if p["fetch"] == "requests"]
+    pw_portals  = [p for p in portals if p["fetch"] == "playwright"]
+    log.info(f"[CLI] portale: {', '.join(p['source'] for p in portals)}; lokalizacje: {', '.join(locations)}")
+
+    if HTTP_CACHE_MODE != "off":
+        HTTP_CACHE = ResponseCache(STATE_DIR / "http_cache")
+        HTTP_CACHE.evict()
+
+    # Replay służy do strojenia parserów: bez wczesnego przerywania i bez zapisu do bazy
+    replay = HTTP_CACHE_MODE == "replay"
+    if not replay:
+        STORE = ListingStore(STATE_DIR / "listings.db")
+        STORE.seed_from(out_path)
+        log.info(f"[Store] {len(STORE.known_ids)} znanych ofert, tryb "
+                 f"{'przyrostowy' if STORE.incremental else 'pełny'}")
+        RATE_LIMITER.load(json.loads(STORE.get_meta("rate_limits", "{}")))
+
+    # Przebieg przerwany niedawno (timeout workflow, awaria) jest dokańczany zamiast zaczynany od nowa;
+    # przebieg częściowy dokłada się do takiego otwartego przebiegu, ale sam go nie otwiera
+    run_id, resume = run_started, False
+    if not replay:
+        open_run = STORE.get_meta("open_run")
+        if open_run and datetime.utcnow() - datetime.fromisoformat(open_run) < timedelta(hours=RESUME_MAX_AGE_HOURS):
+            run_id, resume = open_run, True
+        else:
+            STORE.clear_frontier()
+            STORE.set_meta("open_run", run_id if full_run else "")
+    frontier = CrawlFrontier(STORE, run_id)
+    if resume:
+        done, started = frontier.resumed()
+        log.info(f"[Frontier] wznawiam przebieg z {run_id}: {done}/{started} par portal × lokalizacja gotowych")
+
+    # Parsowanie w osobnych procesach; "spawn", bo proces główny ma już wątki (fork z wątkami jest niepewny)
+    if PARSE_PROCESSES > 1:
+        PARSE_POOL = ProcessPoolExecutor(PARSE_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+
+    # Oferty płyną ze scraperów prosto do sinka (NDJSON + baza), bez zbierania w pamięci
+    sink = ResultSink(STATE_DIR / "run.ndjson", STORE, run_started, resume=resume)
+
+    # Szybkie scrapery (requests) — każda para portal × lokalizacja to osobne zadanie w puli
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="scrape") as pool:
+        futures = [pool.submit(_run_job, portal, loc_key, loc_data, sink, frontier)
+                   for loc_key, loc_data in locations.items()
+                   for portal in req_portals]
+
+        # Portale JS (Playwright) — w głównym wątku, równolegle z pulą requests; bez nich Chromium nie startuje
+        if pw_portals:
             try:
-                items = scrape_with_playwright(loc_key, loc_data, browser)
-                all_results.extend(items)
+                asyncio.run(run_playwright_stage(locations, sink, frontier, pw_portals))
             except Exception as e:
-                log.error(f"Playwright failed for {loc_key}: {e}")
-
-        browser.close()
-
-    # Deduplikacja
-    seen, unique = set(), []
-    for item in all_results:
-        if item["id"] not in seen:
-            seen.add(item["id"])
-            unique.append(item)
+                log.error(f"Playwright failed: {e}")
+
+        for fut in futures:
+            fut.result()
+
+    if replay:
+        new_ids, listings, history = set(), list(sink.items()), None
+        sink.close()
+    else:
+        new_ids = sink.new_ids
+        # Zbieranie zakończone — następny start to nowy przebieg. Częściowy przebieg dołożony
+        # do otwartego zostawia go otwartym: resztę par dokończy następny pełny start
+        if full_run or not resume:
+            if full_run and not STORE.incremental:
+                STORE.set_meta("last_full_crawl", run_id)
+            STORE.set_meta("open_run", "")
+            STORE.clear_frontier()
+        log.info(f"[Store] bieżący przebieg: {len(sink)} ofert, nowe: {len(new_ids)}")
+
+        if ENRICH_DETAILS:
+            enrich_listings(sink.items(), STORE, run_started)
+        sink.close()
+
+        # Do data.json trafiają też oferty z wcześniejszych przebiegów, jeśli były niedawno widziane
+        cutoff   = (datetime.utcnow() - timedelta(days=STALE_AFTER_DAYS)).isoformat()
+        listings = STORE.listings(seen_since=cutoff)
+        details  = STORE.details()
+        for item in listings:
+            if item["id"] in details:
+                apply_details(item, details[item["id"]][1])
+        before   = len(listings)
+        listings = [item for item in listings if within_radius(item)]
+        if before > len(listings):
+            log.info(f"[Geo] {before - len(listings)} ofert poza promieniem wg współrzędnych")
+        if THUMBS:
+            attach_thumbs(listings, STORE, out_path.parent, run_started)
+        history = STORE.market_history()
+        STORE.set_meta("rate_limits", json.dumps(RATE_LIMITER.state()))
+        STORE.close()
+    close_sessions()
+    if PARSE_POOL is not None:
+        PARSE_POOL.shutdown()
+        PARSE_POOL = None
+
+    # Ta sama działka z kilku portali → jeden rekord z listą źródeł
+    before   = len(listings)
+    listings = dedup_listings(listings)
+    log.info(f"[Dedup] scalono {before - len(listings)} duplikatów między portalami")
+    # Stała kolejność (najnowsze, potem id) — niezmienione oferty nie przesuwają się w data.json
+    listings.sort(key=lambda item: item["id"])
+    listings.sort(key=lambda item: item.get("scraped_at") or "", reverse=True)
 
     # Statystyki
     by_source   = {}
     by_location = {}
-    for item in unique:
+    for item in listings:
         by_source[item["source"]]         = by_source.get(item["source"], 0) + 1
         by_location[item["location_area"]] = by_location.get(item["location_area"], 0) + 1
 
@@ -619,22 +2887,60 @@ def main():
     log.info("")
     for loc, cnt in sorted(by_location.items()):
         log.info(f"  {loc}: {cnt}")
-    log.info(f"  ŁĄCZNIE (unikalne): {len(unique)}")
-
-    output = {
-        "updated_at":  datetime.utcnow().isoformat() + "Z",
-        "total":       len(unique),
+    log.info(f"  ŁĄCZNIE (unikalne): {len(listings)}")
+
+    with METRICS.timer("stats"):
+        stats = market_stats(listings, history)
+    for loc_key, entry in (stats or {}).get("locations", {}).items():
+        if "price_per_m2" in entry:
+            log.info(f"  {loc_key}: mediana {entry['price_per_m2']['p50']} zł/m², "
+                     f"nietypowych {entry['outliers']}, obniżek {entry['price_drops']}")
+
+    updated_at = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+    summary = {
+        "updated_at":  updated_at,
+        "total":       len(listings),
+        "new":         len(new_ids),
         "by_source":   by_source,
         "by_location": by_location,
-        "listings":    unique,
     }
 
-    out_path = Path(__file__).parent.parent / "docs" / "data.json"
-    out_path.parent.mkdir(exist_ok=True)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    previous = None
+    if out_path.exists():
+        try:
+            with open(out_path, encoding="utf-8") as f:
+                previous = json.load(f)
+        except Exception as e:
+            log.warning(f"[Zmiany] nie można wczytać poprzedniego {out_path.name}: {e}")
+    if previous is not None and previous.get("listings") == json.loads(json.dumps(listings)):
+        # Oferty bez zmian — poprzedni znacznik czasu, więc data.json i manifest zostają bajt w bajt
+        # i przebieg nie tworzy commitu; updated_at to czas ostatniej zmiany danych
+        summary["updated_at"] = previous.get("updated_at", updated_at)
+        summary["new"]        = previous.get("new", summary["new"])
+        log.info("[Zmiany] oferty bez zmian względem poprzedniego data.json")
+    elif previous is not None:
+        # Zmiany względem poprzedniej migawki (data.json sprzed nadpisania) → changes.json + feed.xml
+        diff = diff_snapshots(previous.get("listings", []), listings)
+        write_changes(diff, updated_at, out_path.parent)
+        log.info(f"[Zmiany] nowe: {len(diff['added'])}, usunięte: {len(diff['removed'])}, "
+                 f"zmiany cen: {len(diff['price_changed'])}")
+
+    # Bez wcięć — strona czyta shardy, data.json to pełna migawka dla API i diffu następnego przebiegu
     with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
+        json.dump({**summary, "listings": listings}, f, ensure_ascii=False, separators=(",", ":"))
+
+    # Wersja dla strony: mały indeks + shardy z hashem w nazwie
+    manifest = write_shards(listings, summary, out_path.parent / "data", stats)
+
+    log.info(f"\n✅ Zapisano {len(listings)} ofert → {out_path} (+ {len(manifest['shards'])} shardów)")
 
-    log.info(f"\n✅ Zapisano {len(unique)} ofert → {out_path}")
+    METRICS.info.update({"listings_total": len(listings), "listings_new": len(new_ids),
+                         "rate_limits": RATE_LIMITER.state()})
+    # Raport zmienia się co przebieg — poza docs/, żeby nie commitować go z danymi (w CI: artefakt)
+    METRICS.write(STATE_DIR / "run_report.json")
+    for stage, t in sorted(METRICS.totals.items(), key=lambda x: -x[1]["seconds"]):
+        log.info(f"  ⏱ {stage}: {t['seconds']:.1f}s ({t['count']}×)")
 
 
 if __name__ == "__main__":